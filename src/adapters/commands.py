@@ -0,0 +1,16 @@
+from injectors.connections import session
+from models.commands import CommandTree
+
+
+class CommandTreeAdapter:
+
+    async def get_hash(self, scope: str) -> str | None:
+        """Хэш дерева команд, синхронизированного для scope"""
+
+        async with session() as pg:
+            tree = await pg.get(CommandTree, scope)
+        return tree.hash if tree is not None else None
+
+    async def save_hash(self, scope: str, tree_hash: str):
+        async with session() as pg:
+            await pg.merge(CommandTree(scope=scope, hash=tree_hash))
@@ -1,20 +1,37 @@
+import typing as t
 from datetime import datetime
 
 import psycopg2.errorcodes
 import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import IntegrityError
 
-from injectors.connections import acquire_session
+from injectors.connections import session
 from models import exceptions
-from models.music import Song, Playback, QueuePos
+from models.music import Song, Playback, QueuePos, CachedAudio, StreamInfo
+from services import metrics
 
+# канал NOTIFY с id удаленной песни
+SONG_REMOVED = 'letov_song_removed'
 
-class MusicAdapter:
+def is_unique_violation(error: IntegrityError) -> bool:
+    """Проверка, что ошибка вызвана нарушением уникальности"""
+
+    pgcode = getattr(error.orig, 'pgcode', None) \
+        or getattr(error.orig.__cause__, 'sqlstate', None)
+    return pgcode == psycopg2.errorcodes.UNIQUE_VIOLATION
+
+
+def escape_like(value: str) -> str:
+    """Экранирование спецсимволов LIKE"""
+
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
 
-    def __init__(self):
-        self.pg = acquire_session()
 
-    def get_songs(self, limit: int = 0, order_by=Song.id) -> list[Song]:
+@metrics.timed_methods(metrics.DB_QUERY)
+class MusicAdapter:
+
+    async def get_songs(self, limit: int = 0, order_by=Song.id) -> list[Song]:
         """Получение списка всех песен"""
 
         query = sa.select(Song).order_by(order_by)
@@ -22,116 +39,288 @@ class MusicAdapter:
         if limit > 0:
             query = query.limit(limit)
 
-        songs = self.pg.execute(query).scalars().all()
+        async with session() as pg:
+            songs = (await pg.execute(query)).scalars().all()
         return songs
 
-    def get_first_in_queue(self, guild_id: int) -> QueuePos:
-        """Получение первой песни в очереди"""
-
-        query = sa.select(QueuePos) \
-            .where(QueuePos.guild_id == guild_id) \
-            .order_by(QueuePos.id) \
-            .limit(1)
-        return self.pg.execute(query).scalars().first()
-
-    def get_song_by_id(self, song_id: int) -> Song:
+    async def get_song_by_id(self, song_id: int) -> Song:
         """Получение песни по ее id"""
 
         query = sa.select(Song).where(Song.id == song_id)
-        song = self.pg.execute(query).scalar_one_or_none()
+        async with session() as pg:
+            song = (await pg.execute(query)).scalar_one_or_none()
         return song
 
-    def get_song_by_url(self, url: str) -> Song:
+    async def get_song_by_url(self, url: str) -> Song:
         """Получение песни по url"""
 
         query = sa.select(Song).where(Song.url == url)
-        song = self.pg.execute(query).scalar_one_or_none()
+        async with session() as pg:
+            song = (await pg.execute(query)).scalar_one_or_none()
         return song
 
-    def find_songs(
+    @staticmethod
+    def _name_conditions(key_words: list[str]) -> list:
+        """Условия наличия всех ключевых слов в названии (в любом порядке)"""
+
+        return [
+            Song.name.ilike(f'%{escape_like(word)}%', escape='\\')
+            for word in key_words
+        ]
+
+    async def find_songs(
         self,
         key_words: list[str],
         limit: int = 0,
-        order_by=Song.id
+        order_by=None
     ) -> list[Song]:
-        """Получение списка песен с ключевыми словами в названии"""
+        """Получение списка песен с ключевыми словами в названии
 
-        kw = '%'.join(key_words)
-        query = sa.select(Song) \
-            .filter(Song.name.ilike(f'%{kw}%')) \
-            .order_by(order_by)
+        Слова ищутся в любом порядке через триграммный индекс, без явной
+        сортировки результаты упорядочиваются по релевантности.
+        """
+
+        rank = sa.func.word_similarity(' '.join(key_words), Song.name)
+        query = sa.select(Song).where(*self._name_conditions(key_words))
+
+        if order_by is None:
+            query = query.order_by(rank.desc(), Song.id)
+        else:
+            query = query.order_by(order_by)
 
         if limit > 0:
             query = query.limit(limit)
 
-        song = self.pg.execute(query).scalars().all()
+        async with session() as pg:
+            song = (await pg.execute(query)).scalars().all()
         return song
 
-    def add_song(self, title: str, url: str) -> Song:
+    async def get_songs_page(
+        self,
+        key_words: list[str] = None,
+        after: tuple = None,
+        before: tuple = None,
+        limit: int = 20
+    ) -> list[Song]:
+        """Страница списка песен с keyset-пагинацией
+
+        Без ключевых слов песни упорядочены по id, с ними - по названию.
+        after/before - ключ сортировки последней/первой песни соседней
+        страницы, (name, id) или (id,) соответственно.
+        """
+
+        columns = (Song.name, Song.id) if key_words else (Song.id,)
+        key = sa.tuple_(*columns)
+        query = sa.select(Song).limit(limit)
+
+        if key_words:
+            query = query.where(*self._name_conditions(key_words))
+
+        if before is not None:
+            query = query.where(key < before) \
+                .order_by(*(column.desc() for column in columns))
+        else:
+            if after is not None:
+                query = query.where(key > after)
+            query = query.order_by(*columns)
+
+        async with session() as pg:
+            songs = (await pg.execute(query)).scalars().all()
+
+        return songs[::-1] if before is not None else songs
+
+    async def add_song(self, title: str, url: str, duration: int = None) -> Song:
         """Добавление песни в БД"""
 
-        song = Song(name=title, url=url)
+        song = Song(name=title, url=url, duration=duration)
 
-        try:
-            self.pg.add(song)
-            self.pg.commit()
-        except IntegrityError as e:
-            self.pg.rollback()
-            if e.orig.pgcode == psycopg2.errorcodes.UNIQUE_VIOLATION:
-                raise exceptions.DuplicateSong
-            raise
+        async with session() as pg:
+            try:
+                pg.add(song)
+                await pg.flush()
+            except IntegrityError as e:
+                if is_unique_violation(e):
+                    raise exceptions.DuplicateSong
+                raise
 
         return song
 
-    def remove_song(self, song_id: int):
-        """Удаление песни из БД"""
+    async def add_songs(self, songs: list[tuple[str, str, int | None]]) -> list[Song]:
+        """Добавление пачки песен (название, url, длительность) в БД
 
-        query = sa.delete(Song).where(Song.id == song_id)
-        self.pg.execute(query)
-        self.pg.commit()
+        Уже сохраненные песни не дублируются. Возвращает песни
+        в порядке переданного списка.
+        """
 
-    def get_queue(self, guild_id: int) -> list[QueuePos]:
-        """Получение очереди воспроизведения"""
+        if not songs:
+            return []
 
-        query = sa.select(QueuePos) \
-            .where(QueuePos.guild_id == guild_id) \
-            .order_by(QueuePos.id)
-        queue = self.pg.execute(query).scalars().all()
-
-        return queue
+        rows = {
+            url: {'name': title[:128], 'url': url, 'duration': duration}
+            for title, url, duration in songs
+        }
+        insert = pg_insert(Song).values(list(rows.values())) \
+            .on_conflict_do_nothing(index_elements=['url'])
 
-    def add_to_queue(self, song: Song, guild_id: int) -> QueuePos:
-        """Добавление песни в очередь"""
+        async with session() as pg:
+            await pg.execute(insert)
+            query = sa.select(Song).where(Song.url.in_(list(rows)))
+            saved = {song.url: song for song in (await pg.execute(query)).scalars()}
 
-        qp = QueuePos(song, guild_id)
-        self.pg.add(qp)
-        self.pg.commit()
+        return [saved[url] for _, url, _ in songs if url in saved]
 
-        return qp
+    async def set_song_gain(self, song_id: int, gain: float):
+        """Сохранение поправки громкости песни"""
 
-    def get_from_queue(self, position: int) -> QueuePos:
-        """Получение песни из очереди"""
+        query = sa.update(Song).where(Song.id == song_id).values(gain=gain)
+        async with session() as pg:
+            await pg.execute(query)
 
-        query = sa.select(QueuePos).where(QueuePos.id == position)
-        qpos = self.pg.execute(query).scalar_one()
+    async def get_songs_without_gain(self, after: int = 0, limit: int = 100) -> list[Song]:
+        """Песни без измеренной громкости, по возрастанию id"""
 
-        return qpos
+        query = sa.select(Song) \
+            .where(Song.gain.is_(None), Song.id > after) \
+            .order_by(Song.id) \
+            .limit(limit)
+        async with session() as pg:
+            return (await pg.execute(query)).scalars().all()
 
-    def del_from_queue(self, position: int):
-        """Удаление песни из очереди"""
+    async def remove_song(self, song_id: int):
+        """Удаление песни из БД с оповещением остальных процессов бота"""
 
-        query = sa.delete(QueuePos).where(QueuePos.id == position)
-        self.pg.execute(query)
-        self.pg.commit()
+        query = sa.delete(Song).where(Song.id == song_id)
+        async with session() as pg:
+            await pg.execute(query)
+            # доставляется слушателям только после фиксации транзакции
+            await pg.execute(
+                sa.text('SELECT pg_notify(:channel, :payload);'),
+                {'channel': SONG_REMOVED, 'payload': str(song_id)}
+            )
+
+    async def get_queue(self, guild_id: int, limit: int = 0) -> list[Song]:
+        """Получение песен очереди воспроизведения
+
+        Одним запросом с join, выбираются только нужные для очереди
+        колонки, без загрузки QueuePos и ленивых запросов к music.music.
+        """
+
+        query = sa.select(Song.id, Song.name, Song.url, Song.duration, Song.gain) \
+            .join(QueuePos, QueuePos.song_id == Song.id) \
+            .where(QueuePos.guild_id == guild_id) \
+            .order_by(QueuePos.id)
 
-    def clear_queue(self, guild_id: int):
-        """Очистка очереди"""
+        if limit > 0:
+            query = query.limit(limit)
 
-        query = sa.delete(QueuePos).where(QueuePos.guild_id == guild_id)
-        self.pg.execute(query)
-        self.pg.commit()
+        async with session() as pg:
+            rows = (await pg.execute(query)).all()
+
+        return [
+            Song(name=row.name, url=row.url, id=row.id, duration=row.duration, gain=row.gain)
+            for row in rows
+        ]
 
-    def add_to_history(self, user: str, song_id: int, guild_id: int):
-        pb = Playback(song_id, user, guild_id, datetime.now())
-        self.pg.add(pb)
-        self.pg.commit()
+    async def save_queue(self, guild_id: int, song_ids: list[int]) -> set[int]:
+        """Перезапись очереди сервера одной транзакцией
+
+        Песни, которых уже нет в music.music, пропускаются.
+        Возвращает их id.
+        """
+
+        async with session() as pg:
+            existing = set((await pg.execute(
+                sa.select(Song.id).where(Song.id.in_(set(song_ids)))
+            )).scalars()) if song_ids else set()
+            rows = [
+                {'guild_id': guild_id, 'song_id': song_id}
+                for song_id in song_ids if song_id in existing
+            ]
+            await pg.execute(sa.delete(QueuePos).where(QueuePos.guild_id == guild_id))
+            if rows:
+                await pg.execute(sa.insert(QueuePos), rows)
+
+        return set(song_ids) - existing
+
+    async def existing_song_ids(self, song_ids: t.Iterable[int]) -> set[int]:
+        """Id песен из переданных, которые еще есть в БД"""
+
+        song_ids = set(song_ids)
+        if not song_ids:
+            return set()
+
+        query = sa.select(Song.id).where(Song.id.in_(song_ids))
+        async with session() as pg:
+            return set((await pg.execute(query)).scalars())
+
+    async def add_to_history(self, playbacks: list[Playback]):
+        """Запись пачки проигрываний одним запросом"""
+
+        rows = [
+            {'song': pb.song, 'user': pb.user, 'guild_id': pb.guild_id, 'date': pb.date}
+            for pb in playbacks
+        ]
+        async with session() as pg:
+            await pg.execute(sa.insert(Playback).values(rows))
+
+    async def get_cached_audio(self) -> list[CachedAudio]:
+        """Получение списка песен в локальном кэше"""
+
+        async with session() as pg:
+            return (await pg.execute(sa.select(CachedAudio))).scalars().all()
+
+    async def get_cached_audio_by_id(self, song_id: int) -> CachedAudio | None:
+        """Получение записи локального кэша песни"""
+
+        async with session() as pg:
+            return await pg.get(CachedAudio, song_id)
+
+    async def save_cached_audio(self, audio: CachedAudio):
+        """Сохранение записи локального кэша"""
+
+        async with session() as pg:
+            await pg.merge(audio)
+
+    async def remove_cached_audio(self, song_id: int):
+        """Удаление записи локального кэша"""
+
+        query = sa.delete(CachedAudio).where(CachedAudio.song_id == song_id)
+        async with session() as pg:
+            await pg.execute(query)
+
+    async def get_stream(self, video_id: str, scope: str) -> dict | None:
+        """Получение непросроченной ссылки на поток из общего кэша"""
+
+        query = sa.select(StreamInfo.info) \
+            .where(StreamInfo.video_id == video_id, StreamInfo.scope == scope) \
+            .where(StreamInfo.expires_at > sa.func.now())
+        async with session() as pg:
+            return (await pg.execute(query)).scalar()
+
+    async def save_stream(self, video_id: str, scope: str, info: dict, expires_at: datetime):
+        """Сохранение ссылки на поток в общий кэш"""
+
+        insert = pg_insert(StreamInfo).values(
+            video_id=video_id, scope=scope, info=info, expires_at=expires_at
+        )
+        insert = insert.on_conflict_do_update(
+            index_elements=['video_id', 'scope'],
+            set_={'info': insert.excluded.info, 'expires_at': insert.excluded.expires_at}
+        )
+        async with session() as pg:
+            await pg.execute(insert)
+
+    async def remove_stream(self, video_id: str, scope: str):
+        """Удаление ссылки из общего кэша (например, после ошибки проигрывания)"""
+
+        query = sa.delete(StreamInfo) \
+            .where(StreamInfo.video_id == video_id, StreamInfo.scope == scope)
+        async with session() as pg:
+            await pg.execute(query)
+
+    async def purge_streams(self) -> int:
+        """Удаление просроченных ссылок из общего кэша"""
+
+        query = sa.delete(StreamInfo).where(StreamInfo.expires_at <= sa.func.now())
+        async with session() as pg:
+            return (await pg.execute(query)).rowcount
@@ -0,0 +1,32 @@
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from injectors.connections import session
+from models.shards import ShardHealth
+
+
+class ShardAdapter:
+
+    async def save_health(self, shards: list[ShardHealth]):
+        """Запись состояния шардов процесса"""
+
+        if not shards:
+            return
+
+        columns = [column.name for column in ShardHealth.__table__.columns]
+        insert = pg_insert(ShardHealth).values([
+            {name: getattr(shard, name) for name in columns} for shard in shards
+        ])
+        insert = insert.on_conflict_do_update(
+            index_elements=['shard_id'],
+            set_={name: insert.excluded[name] for name in columns if name != 'shard_id'}
+        )
+        async with session() as pg:
+            await pg.execute(insert)
+
+    async def get_health(self) -> list[ShardHealth]:
+        """Состояние всех шардов"""
+
+        async with session() as pg:
+            query = sa.select(ShardHealth).order_by(ShardHealth.shard_id)
+            return (await pg.execute(query)).scalars().all()
@@ -1,12 +1,27 @@
+import asyncio
 import dataclasses as dc
 import logging
+import os
 import re
+import socket
+import threading
+import time
+import typing as t
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlparse, parse_qs
 
-import yt_dlp.utils
-from youtube_search import YoutubeSearch
-from yt_dlp import YoutubeDL
-
+from config import config
 from models import exceptions
+from services import metrics
+from services.cache import SingleFlight, TTLCache
+
+# yt_dlp и youtube_search импортируются при первом использовании
+# в потоках пула: их импорт занимает заметную часть запуска
+if t.TYPE_CHECKING:
+    from yt_dlp import YoutubeDL
+
+    from adapters.db import MusicAdapter
 
 
 @dc.dataclass
@@ -18,10 +33,178 @@ class MusicInfo:
     channel: str = dc.field()
     audio_source: str | None = dc.field(default="")
     duration: str = dc.field(default="0:00")
+    codec: str | None = dc.field(default=None)
+
+    @property
+    def seconds(self) -> int | None:
+        """Длительность в секундах"""
+
+        if isinstance(self.duration, (int, float)):
+            return int(self.duration)
+        try:
+            seconds = 0
+            for part in str(self.duration).split(':'):
+                seconds = seconds * 60 + int(part)
+            return seconds
+        except ValueError:
+            return None
+
+
+YDL_OPTS = {'format': 'bestaudio', 'noplaylist': True}
+
+_worker = threading.local()
+
+
+def _acquire_ydl() -> 'YoutubeDL':
+    """Прогретый экземпляр YoutubeDL текущего потока (процесса) пула
+
+    Экземпляр пересоздается после youtube.ydl_max_uses извлечений,
+    по истечении youtube.ydl_max_age секунд и после неожиданных ошибок.
+    """
+
+    ydl = getattr(_worker, 'ydl', None)
+    healthy = ydl is not None \
+        and _worker.uses < config.youtube.ydl_max_uses \
+        and time.monotonic() - _worker.created < config.youtube.ydl_max_age
+
+    if not healthy:
+        from yt_dlp import YoutubeDL
+
+        _discard_ydl()
+        ydl = YoutubeDL(YDL_OPTS)
+        ydl.get_info_extractor('Youtube')
+        _worker.ydl = ydl
+        _worker.uses = 0
+        _worker.created = time.monotonic()
+
+    _worker.uses += 1
+    return ydl
+
+
+def _discard_ydl():
+    """Закрытие экземпляра YoutubeDL текущего потока (процесса)"""
+
+    ydl = getattr(_worker, 'ydl', None)
+    _worker.ydl = None
+    if ydl is not None:
+        try:
+            ydl.close()
+        except Exception as e:
+            logging.warning(f'Failed to close YoutubeDL -> {e}')
+
+
+def _warm_worker():
+    _acquire_ydl()
+    _worker.uses = 0
 
 
 class YouTubeAdapter:
 
+    VIDEO_ID = re.compile(r'(?:youtu\.be/|[?&]v=|/shorts/|/embed/)([\w-]{11})')
+
+    def __init__(self, shared: 'MusicAdapter' = None):
+        self.streams: TTLCache[str, MusicInfo] = TTLCache(
+            config.youtube.stream_cache_size
+        )
+        self.shared = shared
+        # ссылки на потоки привязаны к IP, их делят только процессы одного scope
+        self.stream_scope = (config.sharding.stream_scope or socket.gethostname())[:64]
+        self.searches: TTLCache[tuple[str, int | None], list[MusicInfo]] = TTLCache(
+            config.youtube.search_cache_size, config.youtube.search_ttl
+        )
+        self._flights: SingleFlight[tuple, t.Any] = SingleFlight()
+        self._executor = self._create_executor()
+        # скачивания долгие, у них свой пул, чтобы не занимать разрешение ссылок
+        self._downloads = ThreadPoolExecutor(
+            max_workers=config.audio_cache.download_workers,
+            thread_name_prefix='download'
+        )
+        self._pending = 0
+
+    @staticmethod
+    def _create_executor() -> Executor:
+        if config.youtube.executor == 'process':
+            executor = ProcessPoolExecutor(
+                max_workers=config.youtube.workers, initializer=_warm_worker
+            )
+        else:
+            executor = ThreadPoolExecutor(
+                max_workers=config.youtube.workers,
+                thread_name_prefix='youtube',
+                initializer=_warm_worker
+            )
+        return executor
+
+    def warm_up(self):
+        """Запуск и прогрев всех рабочих пула в фоне
+
+        Вызывается после подключения к Discord, чтобы импорт yt_dlp
+        не замедлял запуск, а первое извлечение не ждало прогрева.
+        """
+
+        for _ in range(config.youtube.workers):
+            self._executor.submit(time.sleep, 0.1)
+
+    def close(self):
+        """Остановка пулов, ожидающие задачи отменяются"""
+
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._downloads.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def pending(self) -> int:
+        """Количество задач в пуле, включая выполняющиеся"""
+
+        return self._pending
+
+    async def _run(
+        self, func: t.Callable, *args, timeout: float = None, executor: Executor = None
+    ) -> t.Any:
+        """Выполнение блокирующей функции в пуле с ограничением времени
+
+        По умолчанию используется пул разрешения ссылок, число задач в нем
+        ограничено youtube.max_pending.
+        """
+
+        resolver = executor is None
+        if resolver and self._pending >= config.youtube.max_pending:
+            raise exceptions.ResolverBusy
+
+        operation = func.__name__.lstrip('_')
+        started = time.perf_counter()
+        future = (executor or self._executor).submit(func, *args)
+        if resolver:
+            # по таймауту рабочий не прерывается, место освобождается по его завершении
+            self._pending += 1
+            future.add_done_callback(self._release(asyncio.get_running_loop()))
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future), timeout or config.youtube.timeout
+            )
+        except asyncio.TimeoutError:
+            metrics.EXTRACTION_FAILURES.labels(operation).inc()
+            raise exceptions.ResolveTimeout
+        except Exception:
+            metrics.EXTRACTION_FAILURES.labels(operation).inc()
+            raise
+        finally:
+            metrics.EXTRACTION.labels(operation).observe(time.perf_counter() - started)
+
+    def _release(self, loop: asyncio.AbstractEventLoop) -> t.Callable:
+        """Callback завершения задачи пула, вызывается в чужом потоке"""
+
+        def done(_):
+            try:
+                loop.call_soon_threadsafe(self._done)
+            except RuntimeError:
+                # цикл событий уже закрыт
+                pass
+
+        return done
+
+    def _done(self):
+        self._pending -= 1
+
     @staticmethod
     def validate_url(url, safe: bool = False) -> bool:
         exp = re.compile(r'https?://(?:www\.)?youtu(?:\.be|be\.com)/\S+')
@@ -33,27 +216,131 @@ class YouTubeAdapter:
         return True
 
     @staticmethod
-    def extract_audio_info(link: str) -> MusicInfo:
+    def is_playlist(url: str) -> bool:
+        """Ссылка ведет на плейлист, а не на отдельное видео"""
+
+        parsed = urlparse(url)
+        return 'list' in parse_qs(parsed.query) and parsed.path.rstrip('/') == '/playlist'
+
+    @classmethod
+    def video_id(cls, link: str) -> str:
+        """Получение id видео из ссылки (или самой ссылки, если id нет)"""
+
+        match = cls.VIDEO_ID.search(link)
+        return match.group(1) if match else link
+
+    @staticmethod
+    def stream_ttl(music_info: MusicInfo) -> float:
+        """Сколько секунд ссылка на поток останется пригодной для проигрывания
+
+        googlevideo отдает срок жизни ссылки в параметре expire. Ссылка
+        должна пережить всю песню, поэтому из срока вычитается ее длительность.
+        """
+
+        query = parse_qs(urlparse(music_info.audio_source or '').query)
+        try:
+            expire = int(query['expire'][0])
+        except (KeyError, IndexError, ValueError):
+            return 0
+
+        duration = music_info.seconds or 0
+        return expire - time.time() - duration - config.youtube.stream_expire_margin
+
+    async def extract_audio_info(self, link: str) -> MusicInfo:
+        """Получение информации о песне из YT с учетом кэша"""
+
+        video_id = self.video_id(link)
+        music_info = self.streams.get(video_id)
+        if music_info is not None:
+            return music_info
+
+        return await self._flights.run(
+            ('info', video_id), lambda: self._resolve_audio_info(video_id, link)
+        )
+
+    async def _resolve_audio_info(self, video_id: str, link: str) -> MusicInfo:
+        music_info = await self._shared_stream(video_id)
+        if music_info is not None:
+            return music_info
+
+        music_info = await self._run(self._extract_audio_info, link)
+        ttl = self.stream_ttl(music_info)
+        if ttl > 0:
+            self.streams.set(video_id, music_info, ttl)
+            await self._share_stream(video_id, music_info, ttl)
+
+        return music_info
+
+    async def invalidate_stream(self, link: str):
+        """Забыть ссылку на поток песни, в том числе в общем кэше"""
+
+        video_id = self.video_id(link)
+        self.streams.pop(video_id)
+        if self.shared is None:
+            return
+        try:
+            await self.shared.remove_stream(video_id, self.stream_scope)
+        except Exception as e:
+            logging.warning(f'Failed to invalidate shared stream of {video_id} -> {e}')
+
+    async def _shared_stream(self, video_id: str) -> MusicInfo | None:
+        """Поиск ссылки, разрешенной другим процессом бота"""
+
+        if self.shared is None:
+            return None
+        try:
+            info = await self.shared.get_stream(video_id, self.stream_scope)
+        except Exception as e:
+            logging.warning(f'Shared stream cache is unavailable -> {e}')
+            return None
+        if info is None:
+            return None
+
+        music_info = MusicInfo(**info)
+        ttl = self.stream_ttl(music_info)
+        if ttl <= 0:
+            return None
+        self.streams.set(video_id, music_info, ttl)
+        return music_info
+
+    async def _share_stream(self, video_id: str, music_info: MusicInfo, ttl: float):
+        if self.shared is None:
+            return
+        expires_at = datetime.now() + timedelta(seconds=ttl)
+        try:
+            await self.shared.save_stream(
+                video_id, self.stream_scope, dc.asdict(music_info), expires_at
+            )
+        except Exception as e:
+            logging.warning(f'Failed to share stream of {video_id} -> {e}')
+
+    @staticmethod
+    def _extract_audio_info(link: str) -> MusicInfo:
         """Получение информации о песне из YT"""
 
-        ydl_opts = {'format': 'bestaudio', 'noplaylist': True}
+        from yt_dlp.utils import DownloadError
 
-        with YoutubeDL(ydl_opts) as ydl:
-            try:
-                info = ydl.extract_info(link, download=False)
-            except yt_dlp.utils.DownloadError as e:
-                raise exceptions.VideoIsUnavailable(link, e.msg)
+        ydl = _acquire_ydl()
+        try:
+            info = ydl.extract_info(link, download=False)
+        except DownloadError as e:
+            raise exceptions.VideoIsUnavailable(link, e.msg)
+        except Exception:
+            _discard_ydl()
+            raise
 
-            formats = info.get("formats") or []
-            candidates = [
-                f for f in formats
-                if f.get("acodec") and f["acodec"] != "none" and f.get("vcodec") in (None, "none")
-            ]
+        formats = info.get("formats") or []
+        candidates = [
+            f for f in formats
+            if f.get("acodec") and f["acodec"] != "none" and f.get("vcodec") in (None, "none")
+        ]
+        # Opus можно отдать в Discord без перекодирования
+        opus = [f for f in candidates if f["acodec"] == "opus"]
 
-            song_format = candidates[0] if candidates else None
-            if not song_format or not song_format.get("url"):
-                logging.error(f"no audio in {formats}")
-                raise ValueError("Не удалось найти подходящий аудиоформат")
+        song_format = (opus or candidates or [None])[0]
+        if not song_format or not song_format.get("url"):
+            logging.error(f"no audio in {formats}")
+            raise ValueError("Не удалось найти подходящий аудиоформат")
 
         music_info = MusicInfo(
             name=info['title'],
@@ -61,12 +348,99 @@ class YouTubeAdapter:
             audio_source=song_format['url'],
             channel=info['channel'],
             duration=info['duration'],
+            codec=song_format['acodec'],
         )
         return music_info
 
-    @classmethod
-    def search(cls, key: str, limit: int = None) -> list[MusicInfo]:
-        """Поиск песен на YT"""
+    async def download_audio(self, link: str, directory: str) -> str:
+        """Скачивание аудио песни, возвращает путь к файлу"""
+
+        return await self._run(
+            self._download_audio, link, directory,
+            timeout=config.audio_cache.download_timeout,
+            executor=self._downloads
+        )
+
+    @staticmethod
+    def _download_audio(link: str, directory: str) -> str:
+        """Скачивание аудио песни (блокирующее), по возможности в Opus"""
+
+        from yt_dlp import YoutubeDL
+        from yt_dlp.utils import DownloadError
+
+        ydl_opts = {
+            'format': 'bestaudio[acodec=opus]/bestaudio',
+            'noplaylist': True,
+            'quiet': True,
+            'outtmpl': os.path.join(directory, '%(id)s.download.%(ext)s'),
+        }
+
+        with YoutubeDL(ydl_opts) as ydl:
+            try:
+                info = ydl.extract_info(link, download=True)
+            except DownloadError as e:
+                raise exceptions.VideoIsUnavailable(link, e.msg)
+            return ydl.prepare_filename(info)
+
+    async def extract_playlist(self, url: str) -> list[MusicInfo]:
+        """Получение списка песен плейлиста без разрешения потоков"""
+
+        return await self._run(self._extract_playlist, url)
+
+    @staticmethod
+    def _extract_playlist(url: str) -> list[MusicInfo]:
+        """Плоское извлечение плейлиста (блокирующее)"""
+
+        from yt_dlp import YoutubeDL
+        from yt_dlp.utils import DownloadError
+
+        ydl_opts = {
+            'extract_flat': 'in_playlist',
+            'quiet': True,
+            'playlistend': config.youtube.playlist_limit,
+        }
+
+        with YoutubeDL(ydl_opts) as ydl:
+            try:
+                info = ydl.extract_info(url, download=False)
+            except DownloadError as e:
+                raise exceptions.VideoIsUnavailable(url, e.msg)
+
+        return [
+            MusicInfo(
+                name=entry.get('title') or entry['id'],
+                url=f'https://youtu.be/{entry["id"]}',
+                channel=entry.get('channel') or entry.get('uploader') or '',
+                duration=entry.get('duration') or 0,
+            )
+            for entry in info.get('entries') or []
+            if entry and entry.get('id')
+        ]
+
+    async def search(self, key: str, limit: int = None) -> list[MusicInfo]:
+        """Поиск песен на YT с кэшем по нормализованному запросу"""
+
+        cache_key = (self.normalize_query(key), limit)
+        result = self.searches.get(cache_key)
+        if result is not None:
+            return list(result)
+
+        async def fetch() -> list[MusicInfo]:
+            found = await self._run(self._search, key, limit)
+            self.searches.set(cache_key, found)
+            return found
+
+        return list(await self._flights.run(('search', *cache_key), fetch))
+
+    @staticmethod
+    def normalize_query(key: str) -> str:
+        return ' '.join(key.casefold().split())
+
+    @staticmethod
+    def _search(key: str, limit: int = None) -> list[MusicInfo]:
+        """Поиск песен на YT (блокирующий)"""
+
+        from youtube_search import YoutubeSearch
 
         result = []
         search_results = YoutubeSearch(key, limit)
@@ -0,0 +1,239 @@
+"""Заменители YouTube, Discord и голосового клиента для офлайн-замеров"""
+
+import asyncio
+import itertools
+import os
+import shutil
+import subprocess
+import threading
+import time
+import typing as t
+
+import discord
+
+from adapters import YouTubeAdapter
+from adapters.youtube import MusicInfo
+from cogs.music import Music
+
+_ids = itertools.count(1)
+
+
+def make_fixture(path: str, seconds: int = 30) -> str:
+    """Генерация тестового Opus-файла через ffmpeg"""
+
+    subprocess.run(
+        [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}',
+            '-ac', '2', '-c:a', 'libopus', path
+        ],
+        check=True
+    )
+    return path
+
+
+class FakeYouTubeAdapter(YouTubeAdapter):
+    """YouTubeAdapter без сети: отдает заготовленный MusicInfo"""
+
+    def __init__(self, audio_source: str, delay: float = 0.0):
+        super().__init__()
+        self.audio_source = audio_source
+        self.delay = delay
+
+    def _info(self, video_id: str) -> MusicInfo:
+        return MusicInfo(
+            name=f'Bench song {video_id}',
+            url=f'https://youtu.be/{video_id}',
+            channel='bench',
+            audio_source=self.audio_source,
+            duration=30,
+            codec='opus',
+        )
+
+    async def extract_audio_info(self, link: str) -> MusicInfo:
+        await asyncio.sleep(self.delay)
+        return self._info(self.video_id(link))
+
+    async def extract_playlist(self, url: str) -> list[MusicInfo]:
+        await asyncio.sleep(self.delay)
+        return [self._info(f'{next(_ids):011d}') for _ in range(20)]
+
+    async def search(self, key: str, limit: int = None) -> list[MusicInfo]:
+        await asyncio.sleep(self.delay)
+        return [self._info(f'{next(_ids):011d}') for _ in range(limit or 5)]
+
+    async def download_audio(self, link: str, directory: str) -> str:
+        await asyncio.sleep(self.delay)
+        path = os.path.join(directory, f'{self.video_id(link)}.download.opus')
+        await asyncio.to_thread(shutil.copyfile, self.audio_source, path)
+        return path
+
+
+class FakeVoiceClient:
+    """Голосовой клиент, который в отдельном потоке читает кадры источника
+
+    Как и настоящий, кодирует PCM в Opus (если libopus доступна) и
+    вызывает after по окончании. pace - пауза между кадрами, 0 - без пауз.
+    """
+
+    def __init__(self, bot: 'FakeBot', guild: 'FakeGuild', pace: float = 0.02):
+        self.bot = bot
+        self.guild = guild
+        self.pace = pace
+        self.source: discord.AudioSource | None = None
+        self.frames = 0
+        self.first_frame_at: float | None = None
+        self.frame_read = threading.Event()
+        self._stopped = threading.Event()
+        self._paused = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._encoder = opus_encoder()
+
+    def play(self, source: discord.AudioSource, *, after: t.Callable = None):
+        self.source = source
+        self.first_frame_at = None
+        self.frame_read.clear()
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(source, after), daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, source: discord.AudioSource, after: t.Callable | None):
+        error = None
+        try:
+            while not self._stopped.is_set():
+                if self._paused.is_set():
+                    time.sleep(self.pace or 0.01)
+                    continue
+                data = self.source.read()
+                if not data:
+                    break
+                if self._encoder is not None and not self.source.is_opus():
+                    self._encoder.encode(data, self._encoder.SAMPLES_PER_FRAME)
+                if self.first_frame_at is None:
+                    self.first_frame_at = time.perf_counter()
+                    self.frame_read.set()
+                self.frames += 1
+                if self.pace:
+                    time.sleep(self.pace)
+        except Exception as e:
+            error = e
+        finally:
+            self.source.cleanup()
+        if after is not None:
+            after(error)
+
+    def is_playing(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() \
+            and not self._paused.is_set()
+
+    def is_paused(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() \
+            and self._paused.is_set()
+
+    def pause(self):
+        self._paused.set()
+
+    def resume(self):
+        self._paused.clear()
+
+    def stop(self):
+        self._stopped.set()
+
+    async def disconnect(self, force: bool = False):
+        self.stop()
+        if self in self.bot.voice_clients:
+            self.bot.voice_clients.remove(self)
+        self.guild.voice_client = None
+
+
+def opus_encoder() -> discord.opus.Encoder | None:
+    if not discord.opus.is_loaded():
+        try:
+            discord.opus._load_default()
+        except Exception:
+            return None
+    try:
+        return discord.opus.Encoder()
+    except Exception:
+        return None
+
+
+class FakeChannel:
+
+    def __init__(self, bot: 'FakeBot', guild: 'FakeGuild'):
+        self.bot = bot
+        self.guild = guild
+
+    async def connect(self) -> FakeVoiceClient:
+        vc = FakeVoiceClient(self.bot, self.guild, self.bot.pace)
+        self.guild.voice_client = vc
+        self.bot.voice_clients.append(vc)
+        return vc
+
+
+class FakeGuild:
+
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.voice_client: FakeVoiceClient | None = None
+
+
+class FakeAuthor:
+
+    def __init__(self, channel: FakeChannel):
+        self.nick = 'bench'
+        self.name = 'bench'
+        self.id = 0
+        self.voice = type('VoiceState', (), {'channel': channel})()
+
+
+class FakeMessage:
+
+    async def delete(self):
+        pass
+
+    async def edit(self, **_):
+        pass
+
+
+class FakeContext:
+    """Контекст команды без Discord: сообщения копятся в sent"""
+
+    def __init__(self, bot: 'FakeBot', guild: FakeGuild):
+        self.bot = bot
+        self.guild = guild
+        self.author = FakeAuthor(FakeChannel(bot, guild))
+        self.sent: list[dict] = []
+
+    @property
+    def voice_client(self) -> FakeVoiceClient | None:
+        return self.guild.voice_client
+
+    async def send(self, content: str = None, **kwargs) -> FakeMessage:
+        self.sent.append({'content': content, **kwargs})
+        return FakeMessage()
+
+
+class FakeBot:
+    """Минимальная замена commands.Bot для кога Music"""
+
+    def __init__(self, pace: float = 0.02):
+        self.loop = asyncio.get_running_loop()
+        self.voice_clients: list[FakeVoiceClient] = []
+        self.pace = pace
+
+
+def make_music_cog(bot: FakeBot, yt: FakeYouTubeAdapter) -> Music:
+    """Ког Music с заменой YouTube и привязанными командами"""
+
+    cog = Music(bot, yt)  # type: ignore
+    for command in cog.get_commands():
+        command.cog = cog
+    return cog
+
+
+def context(bot: FakeBot, guild_id: int) -> FakeContext:
+    return FakeContext(bot, FakeGuild(guild_id))
+
@@ -0,0 +1,192 @@
+"""Нагрузочная симуляция: много гильдий одновременно
+
+    LETOV_CONFIG=../bench.yaml python -m benchmarks.load --guilds 10 50 200
+
+Каждая гильдия в течение --duration секунд выполняет случайные команды
+настоящего кога Music (play, queue add, skip, volume) через заглушки
+Discord и YouTube. Для каждого числа гильдий считаются задержка event
+loop, перцентили времени команд, рост памяти и занятость пула БД.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+
+from benchmarks import fakes
+from benchmarks.suite import git_revision, reset_db, seed_library, summary
+from cogs.music import QueueActions
+from config import config
+from injectors import connections
+from services.gateway import rss_bytes
+
+COMMANDS = (
+    ('play', 3),
+    ('queue_add', 4),
+    ('skip', 2),
+    ('volume', 1),
+)
+
+
+class Sampler:
+    """Фоновые замеры задержки цикла и пула соединений"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.lags: list[float] = []
+        self.checked_out: list[int] = []
+        self._task: asyncio.Task | None = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - started - self.interval))
+            self.checked_out.append(connections.pool_stats().checked_out)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+async def guild_worker(
+        bot, cog, guild: fakes.FakeGuild, library: int,
+        deadline: float, think: float, latencies: dict, errors: dict
+):
+    rng = random.Random(guild.id)
+    names, weights = zip(*COMMANDS)
+
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(rng.expovariate(1 / think))
+        name = rng.choices(names, weights)[0]
+        ctx = fakes.FakeContext(bot, guild)
+        song = str(rng.randint(1, library))
+
+        started = time.perf_counter()
+        try:
+            match name:
+                case 'play':
+                    await cog.play(ctx, song)
+                case 'queue_add':
+                    await cog.queue(ctx, QueueActions.ADD, song)
+                case 'skip':
+                    await cog.skip(ctx)
+                case 'volume':
+                    await cog.volume(ctx, str(rng.randint(1, 100)))
+        except Exception as e:
+            errors[f'{name}: {type(e).__name__}'] += 1
+        latencies[name].append(time.perf_counter() - started)
+
+
+async def run_level(bot, cog, guilds: int, args: argparse.Namespace) -> dict:
+    gc.collect()
+    rss_before = rss_bytes()
+    waits_before = connections.pool_stats()
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    sampler = Sampler()
+    sampler.start()
+
+    deadline = time.perf_counter() + args.duration
+    members = [fakes.FakeGuild(10_000 * guilds + i) for i in range(guilds)]
+    await asyncio.gather(*(
+        guild_worker(bot, cog, guild, args.library, deadline, args.think, latencies, errors)
+        for guild in members
+    ))
+
+    rss_peak = rss_bytes()
+    for guild in members:
+        if guild.voice_client is not None:
+            await guild.voice_client.disconnect()
+    await sampler.stop()
+    await cog.queues.flush()
+    await cog.history.flush()
+    await asyncio.sleep(0.5)
+    gc.collect()
+
+    pool = connections.pool_stats()
+    return {
+        'guilds': guilds,
+        'commands': {name: summary(timings) for name, timings in latencies.items()},
+        'errors': dict(errors),
+        'loop_lag': summary(sampler.lags),
+        'memory': {
+            'rss_before_mb': rss_before / 2 ** 20,
+            'rss_peak_mb': rss_peak / 2 ** 20,
+            'rss_after_mb': rss_bytes() / 2 ** 20,
+        },
+        'db_pool': {
+            'size': pool.size,
+            'checked_out_max': max(sampler.checked_out, default=0),
+            'checked_out_mean': sum(sampler.checked_out) / max(len(sampler.checked_out), 1),
+            'waits': pool.waits - waits_before.waits,
+            'wait_max_ms': pool.wait_max * 1000,
+        },
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    if 'bench' not in config.pg.database:
+        raise SystemExit(
+            f'Refusing to run on database "{config.pg.database}": '
+            f'its name must contain "bench", the music tables are truncated'
+        )
+
+    workdir = tempfile.mkdtemp(prefix='letov-load-')
+    fixture = fakes.make_fixture(os.path.join(workdir, 'fixture.ogg'))
+    config.audio_cache.enabled = False
+    config.loudness.background = False
+
+    bot = fakes.FakeBot(pace=args.pace)
+    cog = fakes.make_music_cog(bot, fakes.FakeYouTubeAdapter(fixture, args.resolve_delay))
+
+    await reset_db()
+    await seed_library(cog, args.library)
+
+    levels = []
+    for guilds in args.guilds:
+        level = await run_level(bot, cog, guilds, args)
+        levels.append(level)
+        print(json.dumps(level, ensure_ascii=False))
+
+    await cog.cog_unload()
+    await connections.dispose()
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'duration': args.duration,
+            'think': args.think,
+            'pace': args.pace,
+            'resolve_delay': args.resolve_delay,
+        },
+        'levels': levels,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', default='load_output.json')
+    parser.add_argument('--guilds', type=int, nargs='+', default=[10, 50, 100, 200])
+    parser.add_argument('--duration', type=float, default=60, help='seconds per level')
+    parser.add_argument('--think', type=float, default=5, help='mean pause between commands')
+    parser.add_argument('--library', type=int, default=1000)
+    parser.add_argument('--pace', type=float, default=0.02, help='seconds per audio frame')
+    parser.add_argument('--resolve-delay', type=float, default=0.3)
+    arguments = parser.parse_args()
+
+    output = asyncio.run(run(arguments))
+    with open(arguments.output, 'w') as file:
+        json.dump(output, file, indent=2, ensure_ascii=False)
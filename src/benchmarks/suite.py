@@ -0,0 +1,224 @@
+"""Офлайн-замеры производительности бота
+
+    LETOV_CONFIG=../bench.yaml python -m benchmarks.suite -o results.json
+
+YouTube и Discord заменены заглушками из benchmarks.fakes, БД - отдельная
+база Postgres из конфига (в имени должно быть "bench", все таблицы music
+очищаются). Для замеров звука нужен ffmpeg. Результаты пишутся в JSON,
+чтобы сравнивать версии между собой.
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import tempfile
+import time
+import os
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from benchmarks import fakes
+from cogs.music import QueueActions
+from config import config
+from injectors import connections
+from services.sources import GainOpusAudio, GainPCMAudio, Track
+
+WORDS = (
+    'летов', 'оборона', 'гражданская', 'все', 'идет', 'по', 'плану', 'моя',
+    'оборона', 'night', 'love', 'summer', 'blue', 'song', 'live', 'remix',
+    'acoustic', 'version', 'dance', 'heart', 'rain', 'city', 'dream', 'fire',
+)
+# ожидание первого кадра, после которого запуск считается неудачным
+FIRST_FRAME_TIMEOUT = 10.0
+
+
+def summary(timings: list[float]) -> dict:
+    """Сводка по замерам в миллисекундах"""
+
+    ordered = sorted(timings)
+    if not ordered:
+        return {'runs': 0}
+    return {
+        'runs': len(ordered),
+        'mean_ms': statistics.mean(ordered) * 1000,
+        'p50_ms': ordered[len(ordered) // 2] * 1000,
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+async def reset_db():
+    await connections.init_db()
+    async with connections.session() as pg:
+        await pg.execute(sa.text(
+            'TRUNCATE music.music, music.queue, music.history, music.audio_cache '
+            'RESTART IDENTITY CASCADE;'
+        ))
+
+
+async def seed_library(cog, size: int, start: int = 0):
+    """Наполнение библиотеки синтетическими песнями"""
+
+    rng = random.Random(size)
+    batch = []
+    for i in range(start, size):
+        name = ' '.join(rng.choices(WORDS, k=4)) + f' {i}'
+        batch.append((name, f'https://youtu.be/{i:011d}', rng.randint(60, 600)))
+        if len(batch) == 1000:
+            await cog.music.add_songs(batch)
+            batch = []
+    await cog.music.add_songs(batch)
+
+
+async def bench_queue_add(bot, cog, ops: int) -> dict:
+    ctx = fakes.context(bot, 1)
+    started = time.perf_counter()
+    for i in range(ops):
+        await cog.queue(ctx, QueueActions.ADD, str(i % 1000 + 1))
+    elapsed = time.perf_counter() - started
+    await cog.queues.flush()
+    return {'ops': ops, 'seconds': elapsed, 'ops_per_second': ops / elapsed}
+
+
+async def bench_find_songs(cog, sizes: list[int], runs: int) -> list[dict]:
+    results = []
+    seeded = 0
+    rng = random.Random(0)
+    for size in sizes:
+        await seed_library(cog, size, seeded)
+        seeded = size
+        async with connections.session() as pg:
+            await pg.execute(sa.text('ANALYZE music.music;'))
+
+        timings = []
+        for _ in range(runs):
+            words = rng.sample(WORDS, 2)
+            started = time.perf_counter()
+            await cog.music.find_songs(words, 24)
+            timings.append(time.perf_counter() - started)
+        results.append({'library_size': size, **summary(timings)})
+    return results
+
+
+async def bench_first_frame(bot, cog, runs: int) -> dict:
+    timings = []
+    failures = 0
+    for i in range(runs):
+        ctx = fakes.context(bot, 1000 + i)
+        started = time.perf_counter()
+        deadline = started + FIRST_FRAME_TIMEOUT
+        await cog.play(ctx, str(i % 1000 + 1))
+        # play только отправляет событие проигрывателю сервера
+        while ctx.voice_client is None and time.perf_counter() < deadline:
+            await asyncio.sleep(0.001)
+        vc = ctx.voice_client
+        if vc is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                None, vc.frame_read.wait, max(deadline - time.perf_counter(), 0)
+            )
+        if vc is None or vc.first_frame_at is None:
+            failures += 1
+        else:
+            timings.append(vc.first_frame_at - started)
+        await cog.stop(ctx)
+    return {**summary(timings), 'failures': failures}
+
+
+def bench_pipeline(fixture: str, frames: int) -> dict:
+    """CPU на кадр для Opus- и PCM-источников (Python и ffmpeg отдельно)"""
+
+    encoder = fakes.opus_encoder()
+    results = {}
+    for name, factory in (
+        ('opus', lambda: GainOpusAudio(Track(fixture, local=True), 0.05)),
+        ('opus_passthrough', lambda: GainOpusAudio(Track(fixture, local=True, codec='opus'), 1.0)),
+        ('pcm', lambda: GainPCMAudio(Track(fixture, local=True), 0.05)),
+    ):
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = time.process_time()
+
+        source = factory()
+        read = 0
+        while read < frames:
+            data = source.read()
+            if not data:
+                break
+            if encoder is not None and not source.is_opus():
+                encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+            read += 1
+        source.cleanup()
+
+        cpu = time.process_time() - cpu
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        ffmpeg = (after.ru_utime - children.ru_utime) + (after.ru_stime - children.ru_stime)
+        results[name] = {
+            'frames': read,
+            'python_cpu_us_per_frame': cpu / max(read, 1) * 1e6,
+            'ffmpeg_cpu_us_per_frame': ffmpeg / max(read, 1) * 1e6,
+            'opus_encoded_in_process': encoder is not None and not source.is_opus(),
+        }
+    return results
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+async def run(args: argparse.Namespace) -> dict:
+    if 'bench' not in config.pg.database:
+        raise SystemExit(
+            f'Refusing to run on database "{config.pg.database}": '
+            f'its name must contain "bench", the music tables are truncated'
+        )
+
+    workdir = tempfile.mkdtemp(prefix='letov-bench-')
+    fixture = fakes.make_fixture(os.path.join(workdir, 'fixture.ogg'))
+    config.audio_cache.enabled = False
+    config.loudness.background = False
+
+    bot = fakes.FakeBot(pace=0)
+    cog = fakes.make_music_cog(bot, fakes.FakeYouTubeAdapter(fixture))
+
+    await reset_db()
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'date': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+        },
+        'find_songs': await bench_find_songs(cog, args.sizes, args.runs),
+        'queue_add': await bench_queue_add(bot, cog, args.ops),
+        'play_to_first_frame': await bench_first_frame(bot, cog, args.runs),
+        'audio_pipeline': bench_pipeline(fixture, args.frames),
+    }
+
+    await cog.cog_unload()
+    await connections.dispose()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', default='bench_output.json')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--ops', type=int, default=1000)
+    parser.add_argument('--frames', type=int, default=1500)
+    arguments = parser.parse_args()
+
+    output = asyncio.run(run(arguments))
+    with open(arguments.output, 'w') as file:
+        json.dump(output, file, indent=2, ensure_ascii=False)
+    print(json.dumps(output, indent=2, ensure_ascii=False))
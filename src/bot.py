@@ -2,6 +2,7 @@ import asyncio
 import logging
 import os
 import signal
+import time
 
 import discord
 from discord.ext import commands
@@ -10,6 +11,8 @@ from config import config
 from injectors import connections
 from models.colors import TextColors
 from models.exceptions import BotException
+from services import gateway, metrics, shards
+from services.startup import phases
 
 config = config.discord
 tc = TextColors()
@@ -22,10 +25,12 @@ logging.basicConfig(
     datefmt='%H:%M:%S'
 )
 
-bot = commands.Bot(
+bot = shards.create_bot(
     command_prefix=config.prefix,
-    intents=discord.Intents.all()
+    **gateway.client_options()
 )
+metrics_server = metrics.MetricsServer(lambda: bot.voice_clients)
+shard_monitor = shards.ShardMonitor(bot)
 
 
 async def send_embed(
@@ -54,18 +59,61 @@ async def send_embed(
 
 @bot.event
 async def on_ready():
-    logging.info('initializing db')
-    connections.init_db()
-    if not os.path.exists('../music'):
-        os.mkdir('../music')
+    phases.end('gateway')
+    phases.mark_ready()
+    if not isinstance(bot, commands.AutoShardedBot):
+        shard_monitor.set_status(None, 'ready')
+    shard_monitor.start()
     logging.info(f'{tc.green}Ready!{tc.end}')
 
 
+@bot.event
+async def on_shard_ready(shard_id: int):
+    shard_monitor.set_status(shard_id, 'ready')
+    logging.info(f'Shard {shard_id} is ready')
+
+
+@bot.event
+async def on_shard_resumed(shard_id: int):
+    shard_monitor.set_status(shard_id, 'ready')
+
+
+@bot.event
+async def on_shard_disconnect(shard_id: int):
+    shard_monitor.set_status(shard_id, 'disconnected')
+
+
+@bot.event
+async def on_resumed():
+    if not isinstance(bot, commands.AutoShardedBot):
+        shard_monitor.set_status(None, 'ready')
+
+
+@bot.event
+async def on_disconnect():
+    if not isinstance(bot, commands.AutoShardedBot):
+        shard_monitor.set_status(None, 'disconnected')
+
+
+@bot.before_invoke
+async def start_command_timer(ctx: commands.Context):
+    ctx.started = time.perf_counter()
+
+
+@bot.after_invoke
+async def stop_command_timer(ctx: commands.Context):
+    metrics.COMMAND_LATENCY.labels(ctx.command.qualified_name) \
+        .observe(time.perf_counter() - ctx.started)
+
+
 @bot.event
 async def on_command_error(
     ctx: commands.Context,
     error: commands.CommandInvokeError
 ):
+    if ctx.command is not None:
+        metrics.COMMAND_ERRORS.labels(ctx.command.qualified_name).inc()
+
     if isinstance(error, commands.CommandNotFound):
         await send_embed(
             ctx, f'Command not found, use {bot.command_prefix}help.',
@@ -97,6 +145,58 @@ async def on_command_error(
         print_exception(error)
 
 
+@bot.command(hidden=True)
+@commands.is_owner()
+async def dbstats(ctx: commands.Context):
+    """Статистика пула соединений с БД"""
+
+    stats = connections.pool_stats()
+    await send_embed(ctx, f'''
+        Pool size: **{stats.size}**
+        Checked out: **{stats.checked_out}**
+        Checked in: **{stats.checked_in}**
+        Overflow: **{stats.overflow}**
+        Wait avg/max: **{stats.wait_avg * 1000:.1f}/{stats.wait_max * 1000:.1f} ms**
+        ''', title='DB pool')
+
+
+@bot.command(hidden=True)
+@commands.is_owner()
+async def memstats(ctx: commands.Context):
+    """Память процесса и кэши discord.py"""
+
+    report = gateway.memory_report(bot)
+    per_guild = report['rss_per_guild']
+    per_guild = f'{per_guild / 2 ** 10:.1f} KiB' if per_guild is not None else '-'
+    await send_embed(ctx, f'''
+        RSS: **{report['rss'] / 2 ** 20:.1f} MiB**
+        Guilds: **{report['guilds']}**
+        RSS per guild: **{per_guild}**
+        Cached members/users: **{report['members']}/{report['users']}**
+        Cached messages: **{report['messages']}**
+        Voice clients: **{report['voice_clients']}**
+        GC objects: **{report['objects']}**
+        Intents: {', '.join(report['intents'])}
+        ''', title='Memory')
+
+
+@bot.command(hidden=True)
+@commands.is_owner()
+async def shardstats(ctx: commands.Context):
+    """Состояние шардов всех процессов бота"""
+
+    lines = []
+    for shard in await shard_monitor.shards.get_health():
+        status = 'stale' if shard_monitor.is_stale(shard) else shard.status
+        latency = f'{shard.latency * 1000:.0f} ms' if shard.latency is not None else '-'
+        lines.append(
+            f'**{shard.shard_id}/{shard.shard_count}** {status}, {latency}, '
+            f'guilds: {shard.guilds}, voice: {shard.voice_clients}, '
+            f'{shard.host}:{shard.pid}'
+        )
+    await send_embed(ctx, '\n'.join(lines) or 'No shards reported', title='Shards')
+
+
 async def setup_extensions():
     for filename in os.listdir('./cogs'):
         if filename.endswith('.py'):
@@ -105,18 +205,36 @@ async def setup_extensions():
 
 
 def sigterm_handler(*_):
-    """Обработчик сигнала завершения"""
+    """Обработчик сигнала завершения
+
+    Бот закрывается штатно: при выгрузке модулей сбрасываются буферы
+    очередей и истории проигрываний.
+    """
 
-    signal.raise_signal(signal.SIGINT)
+    bot.loop.call_soon_threadsafe(bot.loop.create_task, bot.close())
 
 
 async def run():
     signal.signal(signal.SIGTERM, sigterm_handler)
 
-    async with bot:
-        await setup_extensions()
-        logging.info('Connecting to gateway')
-        await bot.start(config.token)
+    phases.record('imports', phases.since_start())
+    try:
+        async with bot:
+            await metrics_server.start()
+            with phases.measure('extensions'):
+                await setup_extensions()
+            with phases.measure('schema'):
+                await connections.init_db()
+                os.makedirs('../music', exist_ok=True)
+            with phases.measure('login'):
+                await bot.login(config.token)
+            logging.info('Connecting to gateway')
+            phases.begin('gateway')
+            await bot.connect()
+    finally:
+        await shard_monitor.stop()
+        await metrics_server.stop()
+        await connections.dispose()
 
 
 if __name__ == '__main__':
@@ -1,11 +1,20 @@
+import asyncio
+import hashlib
+import json
+import logging
 from uuid import uuid4
 
 import discord
 from discord import app_commands
 from discord.ext import commands
 
+from adapters.commands import CommandTreeAdapter
 from adapters.sessions import SessionAdapter
 from models.letov_hub import LetovHubSession
+from services.startup import phases
+
+
+HUB_GUILD = discord.Object(id=358780693595291652)
 
 
 class Hub(commands.Cog):
@@ -13,11 +22,44 @@ class Hub(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.sessions = SessionAdapter()
+        self.trees = CommandTreeAdapter()
+        self._synced = False
+        self._sync_lock = asyncio.Lock()
 
     @commands.Cog.listener()
     async def on_ready(self):
-        await self.bot.tree.sync(guild=discord.Object(id=358780693595291652))
-        await self.bot.tree.sync()
+        # on_ready повторяется после переподключений, синхронизация нужна один раз
+        # при ошибке синхронизация повторится на следующем on_ready
+        async with self._sync_lock:
+            if self._synced:
+                return
+            with phases.measure('tree_sync'):
+                await self.sync_tree(HUB_GUILD)
+                await self.sync_tree()
+            self._synced = True
+
+    def tree_hash(self, guild: discord.abc.Snowflake = None) -> str:
+        """Хэш команд дерева, которые будут отправлены в Discord"""
+
+        payload = sorted(
+            (command.to_dict() for command in self.bot.tree.get_commands(guild=guild)),
+            key=lambda command: command['name']
+        )
+        data = json.dumps([self.bot.application_id, payload], sort_keys=True, default=str)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    async def sync_tree(self, guild: discord.abc.Snowflake = None):
+        """Синхронизация дерева команд, если оно изменилось с прошлого раза"""
+
+        scope = str(guild.id) if guild is not None else 'global'
+        tree_hash = self.tree_hash(guild)
+        if await self.trees.get_hash(scope) == tree_hash:
+            logging.info(f'Command tree {scope} is up to date')
+            return
+
+        await self.bot.tree.sync(guild=guild)
+        await self.trees.save_hash(scope, tree_hash)
+        logging.info(f'Command tree {scope} synced')
 
     @app_commands.command(
         name="hub",
@@ -33,7 +75,7 @@ class Hub(commands.Cog):
             guild=interaction.guild.id
         )
 
-        self.sessions.create_session(session)
+        await self.sessions.create_session(session)
 
         await interaction.response.send_message(
             f"Your URL is: http://hub.letov.fvds.ru/auth?sid={session.sid}", ephemeral=True
@@ -41,4 +83,4 @@ class Hub(commands.Cog):
 
 
 async def setup(bot: commands.Bot):
-    await bot.add_cog(Hub(bot), guilds=[discord.Object(id=358780693595291652)])
+    await bot.add_cog(Hub(bot), guilds=[HUB_GUILD])
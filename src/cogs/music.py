@@ -1,18 +1,27 @@
 import asyncio
 import enum
+import logging
 import math
-from asyncio import run_coroutine_threadsafe, CancelledError
 from typing import Iterable
 
 import discord
 import discord.ui
 from discord.ext import commands
-from discord.utils import get
 
 from adapters import YouTubeAdapter, MusicAdapter
 from adapters.youtube import MusicInfo
+from config import config
 from models import exceptions
-from models.music import Song, QueuePos
+from models.music import Song
+from services.audio_cache import AudioCache
+from services.history import HistoryWriter
+from services.loudness import LoudnessAnalyzer
+from services.notifications import SongRemovals
+from services.playback import PlaybackService, PlayerState
+from services.prefetch import Prefetcher
+from services.queue import QueueService, QueueEntry, GuildQueue
+from services.sources import set_gain
+from views.pagination import KeysetPaginator
 
 MUSIC_PATH = '../music'
 
@@ -25,11 +34,56 @@ class QueueActions(str, enum.Enum):
 
 class Music(commands.Cog):
 
-    def __init__(self, bot: commands.Bot):
-        self.yt = YouTubeAdapter()
+    def __init__(self, bot: commands.Bot, yt: YouTubeAdapter = None):
         self.music = MusicAdapter()
+        self.yt = yt or YouTubeAdapter(
+            self.music if config.sharding.shared_streams else None
+        )
+        self.queues = QueueService(self.music)
+        self.prefetch = Prefetcher(self.yt, self.queues)
+        self.audio_cache = AudioCache(self.yt, self.music)
+        self.history = HistoryWriter(self.music)
         self.bot = bot
         self._music_volume = 0.05
+        self.loudness = LoudnessAnalyzer(self.yt, self.music, self.audio_cache)
+        self.playback = PlaybackService(
+            self.queues, self.yt, self.audio_cache, self.history, self.prefetch,
+            self.loudness, gain=lambda: self._music_volume, notify=self.send_embed
+        )
+        self.removals = SongRemovals(self._song_removed)
+        self._tasks: set[asyncio.Task] = set()
+        self._warmed = False
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # прогрев yt-dlp после подключения, а не во время запуска
+        if not self._warmed:
+            self._warmed = True
+            self.yt.warm_up()
+            self.removals.start()
+
+    def _song_removed(self, song_id: int):
+        # песню удалил этот или другой процесс бота
+        self.queues.discard_song(song_id)
+        self.loudness.gains.pop(song_id, None)
+        self._spawn(self.audio_cache.discard(song_id))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def cog_unload(self):
+        for task in list(self._tasks):
+            task.cancel()
+        self.removals.close()
+        self.playback.close()
+        self.loudness.close()
+        self.prefetch.close()
+        await self.audio_cache.close()
+        self.yt.close()
+        await self.queues.close()
+        await self.history.close()
 
     @property
     def music_volume_exp(self) -> int:
@@ -85,13 +139,13 @@ class Music(commands.Cog):
 
         if len(args) == 1 and args[0].isnumeric():
             song_id = int(args[0])
-            song = self.music.get_song_by_id(song_id)
+            song = await self.music.get_song_by_id(song_id)
         elif len(args) == 1 and args[0].startswith('http'):
             url = args[0]
-            song = self.music.get_song_by_url(url)
+            song = await self.music.get_song_by_url(url)
         else:
             key_words = list(args)
-            songs = self.music.find_songs(key_words, 24)
+            songs = await self.music.find_songs(key_words, 24)
             if len(songs) == 0:
                 song = None
             elif len(songs) == 1:
@@ -126,8 +180,8 @@ class Music(commands.Cog):
         async def callback(interaction: discord.Interaction):
             await interaction.message.delete()
             response: discord.InteractionResponse = interaction.response  # type: ignore
-            song_id = interaction.data['values'][0]
-            song_list['chosen_song'] = self.music.get_song_by_id(song_id)
+            song_id = int(interaction.data['values'][0])
+            song_list['chosen_song'] = await self.music.get_song_by_id(song_id)
             response.is_done()
             event.set()
 
@@ -198,31 +252,27 @@ class Music(commands.Cog):
 
         return song_list['chosen_song']
 
-    async def connect(self, ctx: commands.Context):
-        status = get(self.bot.voice_clients, guild=ctx.guild)
-        if not status:
-            await ctx.author.voice.channel.connect()
-
-    @classmethod
-    async def disconnect(cls, ctx: commands.Context):
-        await ctx.voice_client.disconnect(force=False)
-
     @commands.command()
     async def add(self, ctx: commands.Context, *args: str) -> Song | None:
         """Добавление песни"""
 
         args_str = ' '.join(args)
 
+        if self.yt.is_playlist(args_str):
+            await self.import_playlist(ctx, args_str)
+            return None
+
         if self.yt.validate_url(args_str, safe=True):
-            music_info = self.yt.extract_audio_info(args_str)
+            music_info = await self.yt.extract_audio_info(args_str)
         else:
             await self.send_embed(
                 ctx, f'Searching **{args_str}** on YouTube...', color=discord.Colour.yellow())
-            search_result = self.yt.search(args_str, 5)
+            search_result = await self.yt.search(args_str, 5)
             music_info = await self.select_song_from_search(ctx, search_result, args)
 
         try:
-            song = self.music.add_song(music_info.name, music_info.url)
+            song = await self.music.add_song(
+                music_info.name, music_info.url, music_info.seconds)
         except exceptions.DuplicateSong as e:
             await self.send_embed(ctx, str(e), color=discord.Colour.red())
             return None
@@ -231,6 +281,51 @@ class Music(commands.Cog):
 
         return song
 
+    async def import_playlist(
+            self,
+            ctx: commands.Context,
+            url: str,
+            queue: GuildQueue | None = None
+    ) -> int:
+        """Импорт плейлиста в библиотеку и, если передана, в очередь
+
+        Первая пачка песен добавляется сразу, чтобы воспроизведение могло
+        начаться, остальные догружаются в фоне.
+        """
+
+        await self.send_embed(
+            ctx, 'Loading playlist...', color=discord.Colour.yellow())
+        infos = await self.yt.extract_playlist(url)
+        if not infos:
+            await self.send_embed(
+                ctx, 'Playlist is empty', color=discord.Colour.red())
+            return 0
+
+        batch = config.youtube.playlist_batch
+        await self._import_batch(infos[:batch], queue)
+        if len(infos) > batch:
+            self._spawn(self._import_rest(infos[batch:], queue))
+
+        await self.send_embed(
+            ctx, f'Added **{len(infos)}** songs from playlist',
+            color=discord.Colour.green())
+        return len(infos)
+
+    async def _import_batch(self, infos: list[MusicInfo], queue: GuildQueue | None):
+        songs = await self.music.add_songs([(i.name, i.url, i.seconds) for i in infos])
+        if queue is not None:
+            for song in songs:
+                queue.append(song)
+            self.prefetch.schedule(queue.guild_id)
+
+    async def _import_rest(self, infos: list[MusicInfo], queue: GuildQueue | None):
+        batch = config.youtube.playlist_batch
+        try:
+            for i in range(0, len(infos), batch):
+                await self._import_batch(infos[i:i + batch], queue)
+        except Exception as e:
+            logging.error(f'Playlist import failed -> {e}')
+
     @commands.command()
     async def remove(self, ctx: commands.Context, song_id: str):
         """Удаление песни"""
@@ -240,8 +335,10 @@ class Music(commands.Cog):
                 ctx, 'Incorrect argument', color=discord.Colour.red())
             return
 
-        song = self.music.get_song_by_id(int(song_id))
-        self.music.remove_song(song.id)
+        song = await self.music.get_song_by_id(int(song_id))
+        await self.music.remove_song(song.id)
+        self.queues.discard_song(song.id)
+        await self.audio_cache.discard(song.id)
 
         await self.send_embed(
             ctx, f'**{song.name} has been removed**',
@@ -252,42 +349,39 @@ class Music(commands.Cog):
     async def list(self, ctx: commands.Context, *args: str):
         """Получение всего списка песен или по ключевым словам"""
 
-        if args:
-            key_words = list(args)
-            songs = self.music.find_songs(key_words, order_by=Song.name)
-        else:
-            songs = self.music.get_songs()
+        key_words = list(args) or None
 
-        title = 'Song list'
-        description = ''
+        async def fetch(after, before, limit: int) -> list[Song]:
+            return await self.music.get_songs_page(
+                key_words, after=after, before=before, limit=limit
+            )
 
-        for song in songs:
-            row = f'( **{song.id}** )  {song.name}\n'
-            if len(description + row) < 4000:
-                description += row
-                continue
-            else:
-                await self.send_embed(
-                    ctx, description,
-                    title=title,
-                    color=discord.Colour.from_rgb(7, 133, 70)
-                )
-                description = row
-            title = None
-        await self.send_embed(
-            ctx, description,
-            title=title,
-            color=discord.Colour.from_rgb(7, 133, 70)
-        )
+        def key(song: Song) -> tuple:
+            return (song.name, song.id) if key_words else (song.id,)
+
+        def render(songs: list[Song], page: int) -> discord.Embed:
+            embed = discord.Embed(
+                title='Song list',
+                description='\n'.join(f'( **{song.id}** )  {song.name}' for song in songs),
+                colour=discord.Colour.from_rgb(7, 133, 70)
+            )
+            embed.set_footer(text=f'Page {page + 1}')
+            return embed
+
+        paginator = KeysetPaginator(fetch, key, render)
+        if not await paginator.start(ctx):
+            await self.send_embed(
+                ctx, 'Nothing found', color=discord.Colour.red())
 
     @commands.command(brief='Cancel playback')
     async def stop(self, ctx: commands.Context):
-        try:
-            await self.disconnect(ctx)
-        except AttributeError:
+        if ctx.voice_client is None \
+                and self.playback.state(ctx.guild.id) is PlayerState.IDLE:
             await self.send_embed(
                 ctx, 'Nothing to stop', color=discord.Colour.red()
             )
+            return
+        self.playback.stop(ctx)
 
     @commands.command(brief='Pauses playback.')
     async def pause(self, ctx: commands.Context):
@@ -309,88 +403,39 @@ class Music(commands.Cog):
                 ctx, 'Nothing is paused', color=discord.Colour.red()
             )
 
+    @commands.command(brief='Skips current song')
+    async def skip(self, ctx: commands.Context):
+        """Переход к следующей песне: after текущей отправит событие проигрывателю"""
+        if self.is_playing(ctx):
+            ctx.voice_client.stop()
+        else:
+            await self.send_embed(
+                ctx, 'Nothing is playing.', color=discord.Colour.red()
+            )
+
     @commands.command(name='play')
     async def play(self, ctx: commands.Context, *args: str):
         """Проигрывание музыки"""
 
-        is_playing = self.is_playing(ctx)
+        is_playing = self.playback.state(ctx.guild.id) is not PlayerState.IDLE
+        queue = await self.queues.get(ctx.guild.id)
 
         if args:
             if not is_playing:
-                self.music.clear_queue(ctx.guild.id)
+                queue.clear()
 
             await self.queue(ctx, QueueActions.ADD, *args)
 
         if is_playing:
             return
 
-        q = self.music.get_first_in_queue(ctx.guild.id)
-
-        if q is None:
+        if queue.first() is None:
             await self.send_embed(
                 ctx, "Nothing to play ¯\\_(ツ)_/¯", color=discord.Colour.red()
             )
             return
 
-        try:
-            await self.connect(ctx)
-        except AttributeError:
-            await self.send_embed(
-                ctx, 'Connect to a voice channel before playing.',
-                color=discord.Colour.red())
-            return
-
-        await self.player(ctx, q)
-
-    async def player(self, ctx: commands.Context, queue_pos: QueuePos):
-
-        def after_play(error):
-            self.music.del_from_queue(queue_pos.id)
-
-            if error:
-                print(error)
-                return
-            vc = get(self.bot.voice_clients, guild=ctx.guild)
-            if not vc:
-                return
-
-            q = self.music.get_first_in_queue(ctx.guild.id)
-            if q is None:
-                coro = self.disconnect(ctx)
-            else:
-                coro = self.player(ctx, q)
-            future = run_coroutine_threadsafe(
-                coro, self.bot.loop)
-            try:
-                future.result(10)
-            except CancelledError:
-                print('Pizda')
-
-        try:
-            source = self.yt.extract_audio_info(queue_pos.song.url).audio_source
-        except Exception:
-            await self.stop(ctx)
-            raise
-        ffmpeg_opts = {
-            'before_options': '-analyzeduration 0 '
-                              '-re '
-                              '-reconnect 1 '
-                              '-reconnect_streamed 1 '
-                              '-reconnect_delay_max 5 ',
-            'options': '-vn '
-                       '-bufsize 64k '
-        }
-
-        await self.send_embed(ctx, f'Playing **{queue_pos.song.name}**')
-        self.music.add_to_history(
-            ctx.author.nick, queue_pos.song.id, ctx.guild.id
-        )
-
-        ctx.voice_client.play(
-            discord.PCMVolumeTransformer(
-                discord.FFmpegPCMAudio(
-                    source, **ffmpeg_opts
-                ), self._music_volume), after=after_play)
+        self.playback.start(ctx)
 
     @commands.command(aliases=['v'])
     async def volume(self, ctx: commands.Context, volume: str = None):
@@ -416,7 +461,7 @@ class Music(commands.Cog):
             ctx, f'Volume set to **{self.music_volume_exp}%**',
             color=discord.Colour.from_rgb(227, 178, 43))
         if self.is_playing(ctx):
-            ctx.voice_client.source.volume = self._music_volume
+            set_gain(ctx.voice_client, self._music_volume)
 
     @commands.command(aliases=['q'])
     async def queue(
@@ -430,8 +475,15 @@ class Music(commands.Cog):
         match act:
 
             case QueueActions.ADD:
+                if len(args) == 1 and self.yt.is_playlist(args[0]):
+                    queue = await self.queues.get(ctx.guild.id)
+                    await self.import_playlist(ctx, args[0], queue)
+                    return
+
                 song = await self.get_saved_song(ctx, *args) or await self.add(ctx, *args)
-                self.music.add_to_queue(song, ctx.guild.id)
+                queue = await self.queues.get(ctx.guild.id)
+                queue.append(song)
+                self.prefetch.schedule(ctx.guild.id)
                 await self.send_embed(ctx, f'**{song.name}** added to queue')
 
             case QueueActions.DELETE:
@@ -439,21 +491,64 @@ class Music(commands.Cog):
                     await self.send_embed(
                         ctx, 'This is not id', color=discord.Colour.red())
                     return
-                queue_pos = int(args[0]) - 1
-                queue = self.music.get_queue(ctx.guild.id)
-                q = queue[queue_pos]
+                queue = await self.queues.get(ctx.guild.id)
+                try:
+                    q = queue.remove_at(int(args[0]) - 1)
+                except IndexError:
+                    await self.send_embed(
+                        ctx, 'No such position in queue', color=discord.Colour.red())
+                    return
                 song_name = q.song.name
-                self.music.del_from_queue(q.id)
+                self.prefetch.schedule(ctx.guild.id)
                 await self.send_embed(
                     ctx, f'**{song_name}** removed from queue'
                 )
 
             case QueueActions.LIST:
-                queue = self.music.get_queue(ctx.guild.id)
-                msg = ''
-                for i, pos in enumerate(queue):
-                    msg += f'{i + 1: >{len(str(len(queue)))}}.  {pos.song.name}\n'
-                await self.send_embed(ctx, msg, title='Queue')
+                queue = await self.queues.get(ctx.guild.id)
+                await self.send_queue(ctx, queue)
+
+    @staticmethod
+    def format_duration(seconds: int | None) -> str:
+        if seconds is None:
+            return '?:??'
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        if hours:
+            return f'{hours}:{minutes:02}:{seconds:02}'
+        return f'{minutes}:{seconds:02}'
+
+    async def send_queue(self, ctx: commands.Context, queue: GuildQueue):
+        """Постраничный вывод очереди с общей длительностью"""
+
+        async def fetch(after, before, limit: int) -> list[tuple[int, QueueEntry]]:
+            if before is not None:
+                start = max(0, before - limit)
+                limit = before - start
+            else:
+                start = 0 if after is None else after + 1
+            return list(enumerate(queue.slice(start, limit), start))
+
+        def render(entries: list[tuple[int, QueueEntry]], page: int) -> discord.Embed:
+            width = len(str(len(queue)))
+            embed = discord.Embed(
+                title='Queue',
+                description='\n'.join(
+                    f'{i + 1: >{width}}.  {entry.song.name} '
+                    f'({self.format_duration(entry.song.duration)})'
+                    for i, entry in entries
+                ),
+                colour=discord.Colour.blue()
+            )
+            embed.set_footer(
+                text=f'Page {page + 1} · {len(queue)} songs · '
+                     f'{self.format_duration(queue.duration)} total'
+            )
+            return embed
+
+        paginator = KeysetPaginator(fetch, lambda item: item[0], render)
+        if not await paginator.start(ctx):
+            await self.send_embed(ctx, 'Queue is empty', title='Queue')
 
 
 async def setup(bot: commands.Bot):
@@ -1,4 +1,5 @@
 import dataclasses as dc
+import os
 import typing as t
 
 import yaml
@@ -13,6 +14,10 @@ class PGConfig:
     user: str = dc.field()
     password: str = dc.field()
     database: str = dc.field()
+    pool_size: int = dc.field(default=5)
+    max_overflow: int = dc.field(default=5)
+    pool_timeout: float = dc.field(default=30)
+    pool_recycle: int = dc.field(default=1800)
 
 
 @dc.dataclass
@@ -23,14 +28,121 @@ class DiscordConfig:
     locale: t.Literal['ru-RU', 'en_EN'] = dc.field(default='ru-RU')
 
 
+@dc.dataclass
+class GatewayConfig:
+
+    profile: t.Literal['lean', 'full'] = dc.field(default='lean')
+    intents: list[str] | None = dc.field(default=None)
+    member_cache: list[str] = dc.field(default_factory=lambda: ['voice'])
+    max_messages: int = dc.field(default=0)
+    chunk_guilds_at_startup: bool = dc.field(default=False)
+
+
+@dc.dataclass
+class YouTubeConfig:
+
+    stream_cache_size: int = dc.field(default=512)
+    stream_expire_margin: int = dc.field(default=300)
+    prefetch_depth: int = dc.field(default=2)
+    executor: t.Literal['thread', 'process'] = dc.field(default='thread')
+    workers: int = dc.field(default=4)
+    max_pending: int = dc.field(default=32)
+    timeout: float = dc.field(default=30)
+    ydl_max_uses: int = dc.field(default=200)
+    ydl_max_age: float = dc.field(default=3600)
+    playlist_limit: int = dc.field(default=500)
+    playlist_batch: int = dc.field(default=50)
+    search_cache_size: int = dc.field(default=256)
+    search_ttl: float = dc.field(default=600)
+
+
+@dc.dataclass
+class QueueConfig:
+
+    flush_interval: float = dc.field(default=1.0)
+
+
+@dc.dataclass
+class HistoryConfig:
+
+    flush_size: int = dc.field(default=50)
+    flush_interval: float = dc.field(default=10)
+    max_buffer: int = dc.field(default=10000)
+    retry_delay: float = dc.field(default=1.0)
+    max_retry_delay: float = dc.field(default=60)
+
+
+@dc.dataclass
+class AudioCacheConfig:
+
+    enabled: bool = dc.field(default=True)
+    path: str = dc.field(default='../music/cache')
+    max_bytes: int = dc.field(default=2 * 1024 ** 3)
+    policy: t.Literal['lru', 'lfu'] = dc.field(default='lru')
+    min_plays: int = dc.field(default=3)
+    download_timeout: float = dc.field(default=300)
+    download_workers: int = dc.field(default=1)
+
+
+@dc.dataclass
+class PlaybackConfig:
+
+    mode: t.Literal['opus', 'pcm'] = dc.field(default='opus')
+    bitrate: int = dc.field(default=128)
+    connect_timeout: float = dc.field(default=15)
+    resolve_timeout: float = dc.field(default=45)
+    retries: int = dc.field(default=2)
+    retry_delay: float = dc.field(default=1.0)
+
+
+@dc.dataclass
+class LoudnessConfig:
+
+    enabled: bool = dc.field(default=True)
+    target: float = dc.field(default=-16.0)
+    max_gain: float = dc.field(default=12.0)
+    background: bool = dc.field(default=True)
+    concurrency: int = dc.field(default=1)
+    timeout: float = dc.field(default=600)
+
+
+@dc.dataclass
+class MetricsConfig:
+
+    enabled: bool = dc.field(default=True)
+    host: str = dc.field(default='127.0.0.1')
+    # 9100 занят node_exporter
+    port: int = dc.field(default=8455)
+
+
+@dc.dataclass
+class ShardingConfig:
+
+    enabled: bool = dc.field(default=False)
+    shard_count: int | None = dc.field(default=None)
+    processes: int = dc.field(default=1)
+    health_interval: float = dc.field(default=30)
+    shared_streams: bool = dc.field(default=True)
+    stream_scope: str | None = dc.field(default=None)
+
+
 @dc.dataclass
 class Config:
 
     pg: PGConfig = dc.field()
     discord: DiscordConfig = dc.field()
+    gateway: GatewayConfig = dc.field(default_factory=GatewayConfig)
+    youtube: YouTubeConfig = dc.field(default_factory=YouTubeConfig)
+    queue: QueueConfig = dc.field(default_factory=QueueConfig)
+    history: HistoryConfig = dc.field(default_factory=HistoryConfig)
+    audio_cache: AudioCacheConfig = dc.field(default_factory=AudioCacheConfig)
+    playback: PlaybackConfig = dc.field(default_factory=PlaybackConfig)
+    loudness: LoudnessConfig = dc.field(default_factory=LoudnessConfig)
+    metrics: MetricsConfig = dc.field(default_factory=MetricsConfig)
+    sharding: ShardingConfig = dc.field(default_factory=ShardingConfig)
 
 
-with open('../config.yaml', 'r') as file:
+with open(os.environ.get('LETOV_CONFIG', '../config.yaml'), 'r') as file:
     yaml_config = yaml.safe_load(file)
 
 factory = Factory()
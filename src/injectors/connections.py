@@ -1,35 +1,215 @@
+import dataclasses as dc
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
 import sqlalchemy as sa
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine as sa_create_async_engine
+from sqlalchemy.orm import sessionmaker
 
 from config import config
 from models.orm import BaseOrm
 
 
-def create_engine(db: str = None) -> sa.engine.Engine:
+@dc.dataclass
+class PoolStats:
+    """Состояние пула соединений"""
+
+    size: int = dc.field()
+    checked_in: int = dc.field()
+    checked_out: int = dc.field()
+    overflow: int = dc.field()
+    waits: int = dc.field(default=0)
+    wait_total: float = dc.field(default=0.0)
+    wait_max: float = dc.field(default=0.0)
+
+    @property
+    def wait_avg(self) -> float:
+        return self.wait_total / self.waits if self.waits else 0.0
+
+
+_engine: AsyncEngine | None = None
+_session_factory: sessionmaker | None = None
+_waits = {'count': 0, 'total': 0.0, 'max': 0.0}
+
 
-    url = sa.engine.URL.create(
-        drivername='postgresql+psycopg2',
+def _create_url(driver: str, db: str = None) -> sa.engine.URL:
+
+    return sa.engine.URL.create(
+        drivername=driver,
         username=config.pg.user,
         password=config.pg.password,
         host=config.pg.host,
         port=config.pg.port,
         database=db or config.pg.database
     )
+
+
+def create_engine(db: str = None) -> sa.engine.Engine:
+
+    url = _create_url('postgresql+psycopg2', db)
     return sa.create_engine(url=url, echo=False)
 
 
-def acquire_session() -> Session:
+def create_async_engine(db: str = None) -> AsyncEngine:
+
+    url = _create_url('postgresql+asyncpg', db)
+    return sa_create_async_engine(
+        url=url,
+        echo=False,
+        pool_size=config.pg.pool_size,
+        max_overflow=config.pg.max_overflow,
+        pool_timeout=config.pg.pool_timeout,
+        pool_recycle=config.pg.pool_recycle,
+        pool_pre_ping=True
+    )
+
 
-    session = sessionmaker(bind=create_engine(), autoflush=False)
-    session.begin()
-    return session()
+async def connect_raw():
+    """Отдельное соединение asyncpg вне пула (для LISTEN)"""
 
+    import asyncpg
+
+    return await asyncpg.connect(
+        user=config.pg.user,
+        password=config.pg.password,
+        host=config.pg.host,
+        port=config.pg.port,
+        database=config.pg.database
+    )
 
-def init_db():
-    engine = create_engine()
-    with engine.begin():
-        engine.execute('CREATE SCHEMA IF NOT EXISTS music;')
-        engine.execute('CREATE SCHEMA IF NOT EXISTS misc;')
-        engine.run_callable(
-            BaseOrm.REGISTRY.metadata.create_all
+
+def get_engine() -> AsyncEngine:
+    """Общий для всего процесса движок БД"""
+
+    global _engine, _session_factory
+
+    if _engine is None:
+        _engine = create_async_engine()
+        _session_factory = sessionmaker(
+            bind=_engine,
+            class_=AsyncSession,
+            autoflush=False,
+            expire_on_commit=False
         )
+    return _engine
+
+
+@asynccontextmanager
+async def session() -> AsyncIterator[AsyncSession]:
+    """Единица работы с БД.
+
+    Коммитит изменения при успешном выходе, откатывает при ошибке и
+    закрывает сессию, отпуская загруженные объекты и соединение в пул.
+    """
+
+    get_engine()
+    async with _session_factory() as pg:
+        started = time.perf_counter()
+        await pg.connection()
+        waited = time.perf_counter() - started
+        _waits['count'] += 1
+        _waits['total'] += waited
+        _waits['max'] = max(_waits['max'], waited)
+
+        try:
+            yield pg
+            await pg.commit()
+        except BaseException:
+            await pg.rollback()
+            raise
+
+
+def pool_stats() -> PoolStats:
+    """Статистика пула соединений общего движка"""
+
+    pool = get_engine().sync_engine.pool
+    return PoolStats(
+        size=pool.size(),
+        checked_in=pool.checkedin(),
+        checked_out=pool.checkedout(),
+        overflow=pool.overflow(),
+        waits=_waits['count'],
+        wait_total=_waits['total'],
+        wait_max=_waits['max']
+    )
+
+
+async def dispose():
+    """Закрытие всех соединений общего движка"""
+
+    global _engine, _session_factory
+
+    if _engine is not None:
+        await _engine.dispose()
+        _engine, _session_factory = None, None
+
+
+# номер версии схемы, увеличивается при каждом изменении init_db
+SCHEMA_VERSION = 3
+# ключ pg_advisory_xact_lock, чтобы схему готовил только один процесс
+SCHEMA_LOCK = 0x6c65746f76
+
+_schema_ready = False
+
+
+async def init_db():
+    """Подготовка схемы БД, один раз на версию схемы
+
+    Текущая версия хранится в misc.schema_version. Если она не меньше
+    SCHEMA_VERSION, таблицы и индексы не пересоздаются.
+    """
+
+    global _schema_ready
+
+    if _schema_ready:
+        return
+
+    # регистрация всех таблиц в метаданных
+    from models import commands, guilds, letov_hub, music, shards  # noqa: F401
+
+    async with get_engine().begin() as conn:
+        await conn.execute(sa.text('SELECT pg_advisory_xact_lock(:key);'), {'key': SCHEMA_LOCK})
+        version = await _schema_version(conn)
+        # более старый процесс не должен откатывать схему нового
+        if version is None or version < SCHEMA_VERSION:
+            await _create_schema(conn, version)
+
+    _schema_ready = True
+
+
+async def _schema_version(conn) -> int | None:
+    await conn.execute(sa.text('CREATE SCHEMA IF NOT EXISTS misc;'))
+    await conn.execute(sa.text(
+        'CREATE TABLE IF NOT EXISTS misc.schema_version (version INTEGER NOT NULL);'
+    ))
+    return (await conn.execute(sa.text('SELECT max(version) FROM misc.schema_version;'))).scalar()
+
+
+async def _create_schema(conn, version: int | None):
+    await conn.execute(sa.text('CREATE SCHEMA IF NOT EXISTS music;'))
+    if version is not None and version < 3:
+        # кэш ссылок получил scope в первичном ключе, данные не нужны
+        await conn.execute(sa.text('DROP TABLE IF EXISTS music.streams;'))
+    await conn.execute(sa.text('CREATE EXTENSION IF NOT EXISTS pg_trgm;'))
+    await conn.run_sync(BaseOrm.REGISTRY.metadata.create_all)
+    await conn.execute(sa.text(
+        'ALTER TABLE music.music ADD COLUMN IF NOT EXISTS duration INTEGER;'
+    ))
+    await conn.execute(sa.text(
+        'ALTER TABLE music.music ADD COLUMN IF NOT EXISTS gain REAL;'
+    ))
+    await conn.execute(sa.text(
+        'CREATE INDEX IF NOT EXISTS music_name_trgm_idx '
+        'ON music.music USING gin (name gin_trgm_ops);'
+    ))
+    await conn.execute(sa.text(
+        'CREATE INDEX IF NOT EXISTS music_name_id_idx '
+        'ON music.music (name, id);'
+    ))
+    await conn.execute(sa.text('DELETE FROM misc.schema_version;'))
+    await conn.execute(
+        sa.text('INSERT INTO misc.schema_version (version) VALUES (:version);'),
+        {'version': SCHEMA_VERSION}
+    )
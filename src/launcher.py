@@ -0,0 +1,140 @@
+"""Запуск бота в нескольких процессах с распределением шардов
+
+    python launcher.py                       # все шарды на этой машине
+    python launcher.py --shards 0-7 --shard-count 16 --processes 2
+
+Каждый процесс - обычный bot.py с AutoShardedBot, которому через
+окружение передаются свои шарды (LETOV_SHARD_IDS, LETOV_SHARD_COUNT)
+и номер (LETOV_WORKER, к порту метрик прибавляется номер процесса).
+Упавшие процессы перезапускаются, SIGTERM передается всем процессам.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+import time
+
+import aiohttp
+
+from config import config
+
+GATEWAY_URL = 'https://discord.com/api/v10/gateway/bot'
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='[%(asctime)s] launcher: %(message)s',
+    datefmt='%H:%M:%S'
+)
+
+
+async def recommended_shards() -> int:
+    """Рекомендуемое Discord количество шардов"""
+
+    headers = {'Authorization': f'Bot {config.discord.token}'}
+    async with aiohttp.ClientSession(headers=headers) as http:
+        async with http.get(GATEWAY_URL) as response:
+            response.raise_for_status()
+            return (await response.json())['shards']
+
+
+def parse_range(value: str) -> range:
+    first, _, last = value.partition('-')
+    return range(int(first), int(last or first) + 1)
+
+
+def split(shards: range, processes: int) -> list[list[int]]:
+    """Равномерное распределение шардов по процессам"""
+
+    processes = max(1, min(processes, len(shards)))
+    size, rest = divmod(len(shards), processes)
+    groups, start = [], 0
+    for i in range(processes):
+        end = start + size + (i < rest)
+        groups.append(list(shards[start:end]))
+        start = end
+    return groups
+
+
+class Worker:
+    """Процесс бота со своими шардами"""
+
+    def __init__(self, index: int, shard_ids: list[int], shard_count: int):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.process: asyncio.subprocess.Process | None = None
+
+    async def spawn(self):
+        env = {
+            **os.environ,
+            'LETOV_WORKER': str(self.index),
+            'LETOV_SHARD_IDS': ','.join(map(str, self.shard_ids)),
+            'LETOV_SHARD_COUNT': str(self.shard_count),
+        }
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, 'bot.py', env=env
+        )
+        logging.info(
+            f'worker {self.index} (pid {self.process.pid}) '
+            f'shards {self.shard_ids} of {self.shard_count}'
+        )
+
+    async def supervise(self, stopping: asyncio.Event):
+        backoff = 1
+        while not stopping.is_set():
+            started = time.monotonic()
+            await self.spawn()
+            code = await self.process.wait()
+            if stopping.is_set():
+                break
+
+            # быстро падающий процесс перезапускается все реже
+            backoff = 1 if time.monotonic() - started > 60 else min(backoff * 2, 60)
+            logging.warning(
+                f'worker {self.index} exited with {code}, restart in {backoff} s'
+            )
+            try:
+                await asyncio.wait_for(stopping.wait(), backoff)
+            except asyncio.TimeoutError:
+                pass
+
+    def terminate(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.send_signal(signal.SIGTERM)
+
+
+async def run(args: argparse.Namespace):
+    shard_count = args.shard_count or config.sharding.shard_count \
+        or await recommended_shards()
+    shards = parse_range(args.shards) if args.shards else range(shard_count)
+    processes = args.processes or config.sharding.processes
+
+    workers = [
+        Worker(i, group, shard_count)
+        for i, group in enumerate(split(shards, processes))
+    ]
+
+    stopping = asyncio.Event()
+
+    def stop():
+        logging.info('stopping workers')
+        stopping.set()
+        for worker in workers:
+            worker.terminate()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop)
+
+    await asyncio.gather(*(worker.supervise(stopping) for worker in workers))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shard-count', type=int, help='total shards across all hosts')
+    parser.add_argument('--shards', help='shard range of this host, e.g. 0-7')
+    parser.add_argument('--processes', type=int, help='worker processes on this host')
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,29 @@
+import dataclasses as dc
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from .orm import BaseOrm
+
+
+@dc.dataclass
+class CommandTree(BaseOrm):
+    """Хэш последнего синхронизированного с Discord дерева команд"""
+
+    __tablename__ = 'command_trees'
+    __table_args__ = {'schema': 'misc'}
+
+    scope: str = dc.field(metadata={
+        'sa': sa.Column(sa.VARCHAR(64), primary_key=True)
+    })
+
+    hash: str = dc.field(metadata={
+        'sa': sa.Column(sa.VARCHAR(64))
+    })
+
+    synced_at: datetime = dc.field(default_factory=datetime.now, metadata={
+        'sa': sa.Column(sa.TIMESTAMP)
+    })
+
+
+BaseOrm.REGISTRY.mapped(CommandTree)
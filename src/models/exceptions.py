@@ -31,3 +31,11 @@ class VideoIsUnavailable(BotException):
         if self.extra:
             msg += f" -> {self.extra}"
         return msg
+
+
+class ResolverBusy(BotException):
+    MESSAGE = "Too many songs are being resolved right now, try again later"
+
+
+class ResolveTimeout(BotException):
+    MESSAGE = "YouTube took too long to respond"
@@ -3,6 +3,7 @@ import typing as t
 from datetime import datetime
 
 import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relation
 
 from .orm import BaseOrm
@@ -26,6 +27,15 @@ class Song(BaseOrm):
             sa.Integer, primary_key=True, unique=True, autoincrement=True)
     })
 
+    duration: t.Optional[int] = dc.field(default=None, metadata={
+        'sa': sa.Column(sa.Integer)
+    })
+
+    # поправка громкости до целевой (EBU R128), дБ
+    gain: t.Optional[float] = dc.field(default=None, metadata={
+        'sa': sa.Column(sa.REAL)
+    })
+
 
 @dc.dataclass
 class Playback(BaseOrm):
@@ -82,6 +92,66 @@ class QueuePos(BaseOrm):
             self.song_id = self.song.id
 
 
+@dc.dataclass
+class CachedAudio(BaseOrm):
+    """Аудиофайл песни в локальном кэше"""
+
+    __tablename__ = 'audio_cache'
+    __table_args__ = {'schema': 'music'}
+
+    song_id: int = dc.field(metadata={
+        'sa': sa.Column(sa.Integer, sa.ForeignKey(
+            'music.music.id', onupdate='CASCADE', ondelete='CASCADE'),
+            primary_key=True)
+    })
+
+    filename: str = dc.field(metadata={
+        'sa': sa.Column(sa.VARCHAR(128))
+    })
+
+    size: int = dc.field(metadata={
+        'sa': sa.Column(sa.BIGINT)
+    })
+
+    hits: int = dc.field(default=0, metadata={
+        'sa': sa.Column(sa.Integer)
+    })
+
+    last_played: datetime = dc.field(default_factory=datetime.now, metadata={
+        'sa': sa.Column(sa.TIMESTAMP)
+    })
+
+
+@dc.dataclass
+class StreamInfo(BaseOrm):
+    """Разрешенная ссылка на поток, общая для процессов бота одного хоста
+
+    Ссылки googlevideo привязаны к IP, с которого их получили, поэтому
+    делятся только внутри scope (хоста или общего внешнего IP).
+    """
+
+    __tablename__ = 'streams'
+    __table_args__ = {'schema': 'music'}
+
+    video_id: str = dc.field(metadata={
+        'sa': sa.Column(sa.VARCHAR(64), primary_key=True)
+    })
+
+    scope: str = dc.field(metadata={
+        'sa': sa.Column(sa.VARCHAR(64), primary_key=True)
+    })
+
+    info: dict = dc.field(metadata={
+        'sa': sa.Column(JSONB)
+    })
+
+    expires_at: datetime = dc.field(metadata={
+        'sa': sa.Column(sa.TIMESTAMP, index=True)
+    })
+
+
 BaseOrm.REGISTRY.mapped(Song)
 BaseOrm.REGISTRY.mapped(Playback)
 BaseOrm.REGISTRY.mapped(QueuePos)
+BaseOrm.REGISTRY.mapped(CachedAudio)
+BaseOrm.REGISTRY.mapped(StreamInfo)
@@ -0,0 +1,54 @@
+import dataclasses as dc
+import typing as t
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from .orm import BaseOrm
+
+
+@dc.dataclass
+class ShardHealth(BaseOrm):
+    """Последнее состояние шарда, о котором сообщил его процесс"""
+
+    __tablename__ = 'shards'
+    __table_args__ = {'schema': 'misc'}
+
+    shard_id: int = dc.field(metadata={
+        'sa': sa.Column(sa.Integer, primary_key=True, autoincrement=False)
+    })
+
+    shard_count: int = dc.field(metadata={
+        'sa': sa.Column(sa.Integer)
+    })
+
+    status: str = dc.field(metadata={
+        'sa': sa.Column(sa.VARCHAR(16))
+    })
+
+    host: str = dc.field(metadata={
+        'sa': sa.Column(sa.VARCHAR(64))
+    })
+
+    pid: int = dc.field(metadata={
+        'sa': sa.Column(sa.Integer)
+    })
+
+    guilds: int = dc.field(default=0, metadata={
+        'sa': sa.Column(sa.Integer)
+    })
+
+    voice_clients: int = dc.field(default=0, metadata={
+        'sa': sa.Column(sa.Integer)
+    })
+
+    latency: t.Optional[float] = dc.field(default=None, metadata={
+        'sa': sa.Column(sa.Float)
+    })
+
+    updated_at: datetime = dc.field(default_factory=datetime.now, metadata={
+        'sa': sa.Column(sa.TIMESTAMP)
+    })
+
+
+BaseOrm.REGISTRY.mapped(ShardHealth)
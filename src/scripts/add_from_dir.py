@@ -1,31 +1,226 @@
+"""Добавление локальных аудиофайлов в библиотеку
+
+    python add_from_dir.py [music_dir] [-w 8] [-b 500] [--retry-failed]
+
+Файлы хэшируются параллельно в пуле процессов, название и длительность
+читаются из тегов (mutagen). Песни добавляются пачками, после фиксации
+пачки файлы переименовываются в <md5>.<ext>. Файлы, имя которых уже есть
+в БД, пропускаются без чтения. Хэши и ошибки файлов, не попавших в БД,
+хранятся в .ingest.json и переиспользуются, пока у файла не изменились
+размер и mtime.
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
 import os
 import sys
-import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+MANIFEST = '.ingest.json'
+
+
+def hash_file(path: str) -> str:
+    """MD5 содержимого файла через mmap"""
+
+    file_hash = hashlib.md5()
+    with open(path, 'rb') as stream:
+        if os.fstat(stream.fileno()).st_size > 0:
+            with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                file_hash.update(data)
+    return file_hash.hexdigest()
+
+
+def read_tags(path: str) -> tuple[str | None, int | None]:
+    """Название (исполнитель - трек) и длительность в секундах из тегов"""
+
+    import mutagen
+
+    audio = mutagen.File(path, easy=True)
+    if audio is None:
+        return None, None
+
+    duration = getattr(audio.info, 'length', None)
+    tags = audio.tags or {}
+    title = (tags.get('title') or [None])[0]
+    artist = (tags.get('artist') or [None])[0]
+    if title and artist:
+        title = f'{artist} - {title}'
+    return title, int(duration) if duration else None
+
+
+def probe(task: tuple[str, str | None]) -> dict:
+    """Хэш, теги и длительность файла (выполняется в пуле процессов)"""
+
+    path, known_hash = task
+    result = {'path': path}
+    try:
+        result['hash'] = known_hash or hash_file(path)
+        result['title'], result['duration'] = read_tags(path)
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+    return result
+
+
+class Manifest:
+    """Хэши и ошибки файлов по имени, действительные при тех же размере и mtime"""
+
+    def __init__(self, music_dir: str):
+        self.path = os.path.join(music_dir, MANIFEST)
+        try:
+            with open(self.path) as file:
+                self.entries: dict[str, dict] = json.load(file)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, entry: os.DirEntry) -> dict | None:
+        record = self.entries.get(entry.name)
+        stat = entry.stat()
+        if record and record['size'] == stat.st_size and record['mtime'] == stat.st_mtime_ns:
+            return record
+        return None
+
+    def set(self, entry: os.DirEntry, **data):
+        stat = entry.stat()
+        self.entries[entry.name] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, **data}
+
+    def discard(self, name: str):
+        self.entries.pop(name, None)
 
+    def save(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.entries, file)
+        os.replace(tmp_path, self.path)
 
-def insert_music(music_dir: str = '../music'):
+
+class Progress:
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.started = time.monotonic()
+
+    def update(self, count: int):
+        self.done += count
+        elapsed = time.monotonic() - self.started
+        rate = self.done / elapsed if elapsed else 0
+        eta = (self.total - self.done) / rate if rate else 0
+        print(
+            f'{self.done}/{self.total} files, {rate:.1f} files/s, '
+            f'ETA {eta:.0f} s', file=sys.stderr
+        )
+
+
+def insert_batch(pg, batch: list[tuple[os.DirEntry, dict]]) -> int:
+    """Добавление пачки песен одной транзакцией, возвращает число новых"""
+
+    from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+    from models.music import Song
+
+    rows = {}
+    for entry, result in batch:
+        ext = entry.name.rsplit('.', 1)[-1] if '.' in entry.name else ''
+        filename = f'{result["hash"]}.{ext}' if ext else result['hash']
+        name = result['title'] or entry.name.rsplit('.', 1)[0]
+        rows[filename] = {'name': name[:128], 'url': filename, 'duration': result['duration']}
+        result['filename'] = filename
+
+    with pg.begin():
+        inserted = pg.execute(
+            pg_insert(Song).values(list(rows.values()))
+            .on_conflict_do_nothing(index_elements=['url'])
+        ).rowcount
+    return inserted
+
+
+def insert_music(
+    music_dir: str = '../music',
+    workers: int = None,
+    batch_size: int = 500,
+    retry_failed: bool = False,
+):
     sys.path.append('..')
 
+    import sqlalchemy as sa
+
     from injectors import connections
     from models.music import Song
 
-    block_size = 65536
-    pg = connections.acquire_session()
-    for file in os.listdir(music_dir):
-        spited = file.split('.')
-        name, ext = '.'.join(spited[:-1]), spited[-1]
-        file_hash = hashlib.md5()
-        with open(os.path.join(music_dir, file), 'rb') as stream:
-            file_bytes = stream.read(block_size)
-            while len(file_bytes) > 0:
-                file_hash.update(file_bytes)
-                file_bytes = stream.read(block_size)
-        filename = f'{file_hash.hexdigest()}.{ext}'
-        os.rename(os.path.join(music_dir, file), os.path.join(music_dir, filename))
-        song = Song(name, filename)
-        pg.add(song)
-    pg.commit()
+    engine = connections.create_engine()
+    with engine.connect() as pg:
+        known = set(pg.execute(sa.select(Song.url)).scalars())
+
+    manifest = Manifest(music_dir)
+    tasks: dict[str, tuple[os.DirEntry, str | None]] = {}
+    skipped = failed_before = 0
+    for entry in os.scandir(music_dir):
+        if not entry.is_file() or entry.name.startswith('.'):
+            continue
+        if entry.name in known:
+            skipped += 1
+            manifest.discard(entry.name)
+            continue
+
+        record = manifest.get(entry)
+        if record and record.get('error') and not retry_failed:
+            failed_before += 1
+            continue
+        tasks[entry.path] = (entry, record.get('hash') if record else None)
+
+    print(
+        f'{len(tasks)} new files, {skipped} already in library, '
+        f'{failed_before} failed before (use --retry-failed)', file=sys.stderr
+    )
+
+    progress = Progress(len(tasks))
+    inserted = errors = 0
+    batch: list[tuple[os.DirEntry, dict]] = []
+
+    def flush():
+        nonlocal inserted
+        if not batch:
+            return
+        with engine.connect() as pg:
+            inserted += insert_batch(pg, batch)
+        # файлы переименовываются только после фиксации пачки
+        for entry, result in batch:
+            os.replace(entry.path, os.path.join(music_dir, result['filename']))
+            manifest.discard(entry.name)
+        manifest.save()
+        progress.update(len(batch))
+        batch.clear()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        jobs = ((path, known_hash) for path, (_, known_hash) in tasks.items())
+        for result in executor.map(probe, jobs, chunksize=16):
+            entry = tasks[result['path']][0]
+            if 'error' in result:
+                errors += 1
+                manifest.set(entry, hash=result.get('hash'), error=result['error'])
+                print(f'{entry.name}: {result["error"]}', file=sys.stderr)
+                progress.update(1)
+                continue
+
+            manifest.set(entry, hash=result['hash'])
+            batch.append((entry, result))
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+
+    manifest.save()
+    print(f'Added {inserted} songs, {errors} files failed', file=sys.stderr)
 
 
 if __name__ == '__main__':
-    insert_music()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('music_dir', nargs='?', default='../music')
+    parser.add_argument('-w', '--workers', type=int, default=None)
+    parser.add_argument('-b', '--batch', type=int, default=500)
+    parser.add_argument('--retry-failed', action='store_true')
+    args = parser.parse_args()
+
+    insert_music(args.music_dir, args.workers, args.batch, args.retry_failed)
@@ -0,0 +1,67 @@
+"""Измерение громкости песен библиотеки, у которых ее еще нет
+
+    python backfill_loudness.py [-c 4] [--limit 1000]
+
+Песни обрабатываются по возрастанию id, одновременно не больше -c
+измерений ffmpeg. Прерванный запуск можно просто повторить: песни
+с измеренной громкостью пропускаются.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+
+async def backfill(concurrency: int, limit: int = 0, page_size: int = 100):
+    sys.path.append('..')
+
+    from adapters import MusicAdapter, YouTubeAdapter
+    from config import config
+    from injectors import connections
+    from services.audio_cache import AudioCache
+    from services.loudness import LoudnessAnalyzer
+
+    config.loudness.concurrency = concurrency
+    await connections.init_db()
+
+    music = MusicAdapter()
+    yt = YouTubeAdapter()
+    analyzer = LoudnessAnalyzer(yt, music, AudioCache(yt, music))
+
+    done = failed = 0
+    started = time.monotonic()
+    last_id = 0
+    try:
+        while not limit or done + failed < limit:
+            songs = await music.get_songs_without_gain(last_id, page_size)
+            if not songs:
+                break
+            if limit:
+                songs = songs[:limit - done - failed]
+            last_id = songs[-1].id
+
+            # семафор анализатора ограничивает число одновременных ffmpeg
+            for gain in await asyncio.gather(*(analyzer.analyze(song) for song in songs)):
+                if gain is None:
+                    failed += 1
+                else:
+                    done += 1
+
+            elapsed = time.monotonic() - started
+            print(
+                f'{done} measured, {failed} failed, last id {last_id}, '
+                f'{(done + failed) / elapsed:.2f} songs/s', file=sys.stderr
+            )
+    finally:
+        yt.close()
+        await connections.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--concurrency', type=int, default=4)
+    parser.add_argument('--limit', type=int, default=0)
+    args = parser.parse_args()
+
+    asyncio.run(backfill(args.concurrency, args.limit))
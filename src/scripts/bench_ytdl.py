@@ -0,0 +1,68 @@
+"""Сравнение накладных расходов на извлечение с новым и прогретым YoutubeDL
+
+    python bench_ytdl.py [-n 20] [url]
+
+Без url измеряется только фиксированная стоимость подготовки экземпляра
+(разбор опций и инициализация экстрактора YouTube). С url дополнительно
+измеряется полное извлечение, что требует доступа к сети.
+"""
+
+import argparse
+import statistics
+import time
+
+
+def measure(func, runs: int) -> list[float]:
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def report(title: str, timings: list[float]):
+    print(
+        f'{title: <28} '
+        f'mean {statistics.mean(timings) * 1000: >9.2f} ms   '
+        f'median {statistics.median(timings) * 1000: >9.2f} ms   '
+        f'max {max(timings) * 1000: >9.2f} ms'
+    )
+
+
+def bench(runs: int, url: str = None):
+    from yt_dlp import YoutubeDL
+
+    opts = {'format': 'bestaudio', 'noplaylist': True, 'quiet': True}
+
+    def fresh(link: str = None):
+        with YoutubeDL(opts) as ydl:
+            ydl.get_info_extractor('Youtube')
+            if link:
+                ydl.extract_info(link, download=False)
+
+    warm_ydl = YoutubeDL(opts)
+    warm_ydl.get_info_extractor('Youtube')
+
+    def warm(link: str = None):
+        warm_ydl.get_info_extractor('Youtube')
+        if link:
+            warm_ydl.extract_info(link, download=False)
+
+    report('setup, fresh instance', measure(fresh, runs))
+    report('setup, warm instance', measure(warm, runs))
+
+    if url:
+        report('extraction, fresh instance', measure(lambda: fresh(url), runs))
+        report('extraction, warm instance', measure(lambda: warm(url), runs))
+
+    warm_ydl.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('url', nargs='?')
+    parser.add_argument('-n', '--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    bench(args.runs, args.url)
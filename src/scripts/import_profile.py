@@ -0,0 +1,74 @@
+"""Профиль времени импорта модулей бота
+
+    python import_profile.py [-n 30] [--by self] [module ...]
+
+Запускает интерпретатор с -X importtime, импортирует модули бота
+(по умолчанию bot и все коги) и выводит самые дорогие модули.
+cumulative - время вместе с вложенными импортами, self - без них.
+Нужен config.yaml, как и для запуска бота.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def default_modules() -> list[str]:
+    cogs = sorted(
+        f'cogs.{name[:-3]}' for name in os.listdir(os.path.join(SRC, 'cogs'))
+        if name.endswith('.py') and not name.startswith('_')
+    )
+    return ['bot', *cogs]
+
+
+def profile(modules: list[str]) -> list[tuple[str, int, int]]:
+    """(модуль, self мкс, cumulative мкс) для каждого импортированного модуля"""
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {", ".join(modules)}'],
+        cwd=SRC, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((name.strip(), int(own), int(cumulative)))
+    return rows
+
+
+def top_level(rows: list[tuple[str, int, int]]) -> dict[str, int]:
+    """Суммарное собственное время по пакетам верхнего уровня"""
+
+    packages: dict[str, int] = {}
+    for name, own, _ in rows:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + own
+    return packages
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('modules', nargs='*')
+    parser.add_argument('-n', '--top', type=int, default=30)
+    parser.add_argument('--by', choices=('cumulative', 'self'), default='cumulative')
+    args = parser.parse_args()
+
+    rows = profile(args.modules or default_modules())
+    column = 2 if args.by == 'cumulative' else 1
+    total = sum(own for _, own, _ in rows)
+
+    print(f'{len(rows)} modules, {total / 1e6:.3f} s total\n')
+    print(f'{"module": <48} {"self ms": >10} {"cumul. ms": >10}')
+    for name, own, cumulative in sorted(rows, key=lambda row: -row[column])[:args.top]:
+        print(f'{name: <48} {own / 1000: >10.1f} {cumulative / 1000: >10.1f}')
+
+    print(f'\n{"package": <48} {"self ms": >10}')
+    for package, own in sorted(top_level(rows).items(), key=lambda item: -item[1])[:args.top]:
+        print(f'{package: <48} {own / 1000: >10.1f}')
@@ -0,0 +1,188 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import Counter
+from datetime import datetime
+
+from adapters import MusicAdapter, YouTubeAdapter
+from config import config
+from models.music import CachedAudio, Song
+
+
+def hash_file(path: str, block_size: int = 65536) -> str:
+    """MD5 содержимого файла"""
+
+    file_hash = hashlib.md5()
+    with open(path, 'rb') as stream:
+        file_bytes = stream.read(block_size)
+        while len(file_bytes) > 0:
+            file_hash.update(file_bytes)
+            file_bytes = stream.read(block_size)
+    return file_hash.hexdigest()
+
+
+class AudioCache:
+    """Локальный кэш аудиофайлов часто проигрываемых песен.
+
+    Песня скачивается после audio_cache.min_plays проигрываний и хранится
+    под именем из хэша содержимого. Когда суммарный размер превышает
+    audio_cache.max_bytes, файлы вытесняются по политике LRU или LFU.
+    """
+
+    def __init__(self, yt: YouTubeAdapter, music: MusicAdapter):
+        self.yt = yt
+        self.music = music
+        self.path = config.audio_cache.path
+        self._entries: dict[int, CachedAudio] | None = None
+        self._plays: Counter[int] = Counter()
+        self._downloading: set[int] = set()
+        # скачивания ждут здесь, а не в пуле, где на них уже идет download_timeout
+        self._download_slots = asyncio.Semaphore(config.audio_cache.download_workers)
+        self._load_lock = asyncio.Lock()
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def size(self) -> int:
+        return sum(entry.size for entry in (self._entries or {}).values())
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _load(self) -> dict[int, CachedAudio]:
+        """Загрузка списка файлов кэша, файлы без записей удаляются"""
+
+        if self._entries is not None:
+            return self._entries
+
+        async with self._load_lock:
+            if self._entries is not None:
+                return self._entries
+
+            os.makedirs(self.path, exist_ok=True)
+            entries = {}
+            for entry in await self.music.get_cached_audio():
+                # записи без файла могут принадлежать процессу на другой машине
+                if os.path.isfile(os.path.join(self.path, entry.filename)):
+                    entries[entry.song_id] = entry
+
+            # недавние файлы могут скачиваться другим процессом бота
+            known = {entry.filename for entry in entries.values()}
+            stale = time.time() - config.audio_cache.download_timeout
+            for filename in os.listdir(self.path):
+                path = os.path.join(self.path, filename)
+                if filename not in known and os.path.getmtime(path) < stale:
+                    os.remove(path)
+
+            self._entries = entries
+        return self._entries
+
+    async def lookup(self, song: Song) -> str | None:
+        """Путь к локальному файлу песни с учетом проигрывания
+
+        Если файла нет, а песня проигрывается достаточно часто,
+        она скачивается в фоне.
+        """
+
+        if not config.audio_cache.enabled:
+            return None
+
+        entries = await self._load()
+        entry = entries.get(song.id)
+
+        # файл мог вытеснить другой процесс бота с тем же каталогом
+        if entry is not None \
+                and not os.path.isfile(os.path.join(self.path, entry.filename)):
+            entries.pop(song.id)
+            entry = None
+
+        if entry is None:
+            self._plays[song.id] += 1
+            if self._plays[song.id] >= config.audio_cache.min_plays \
+                    and song.id not in self._downloading:
+                self._downloading.add(song.id)
+                self._spawn(self._download(song))
+            return None
+
+        entry.hits += 1
+        entry.last_played = datetime.now()
+        self._spawn(self.music.save_cached_audio(entry))
+        return os.path.join(self.path, entry.filename)
+
+    async def find(self, song_id: int) -> str | None:
+        """Путь к файлу песни в кэше без учета проигрывания"""
+
+        if not config.audio_cache.enabled:
+            return None
+
+        entry = (await self._load()).get(song_id)
+        if entry is None:
+            return None
+        path = os.path.join(self.path, entry.filename)
+        return path if os.path.isfile(path) else None
+
+    async def _download(self, song: Song):
+        try:
+            # песню уже мог скачать другой процесс бота
+            shared = await self.music.get_cached_audio_by_id(song.id)
+            if shared is not None \
+                    and os.path.isfile(os.path.join(self.path, shared.filename)):
+                self._plays.pop(song.id, None)
+                self._entries[song.id] = shared
+                return
+
+            async with self._download_slots:
+                tmp_path = await self.yt.download_audio(song.url, self.path)
+                file_hash = await asyncio.to_thread(hash_file, tmp_path)
+                ext = tmp_path.rsplit('.', 1)[-1]
+                filename = f'{file_hash}.{ext}'
+                os.replace(tmp_path, os.path.join(self.path, filename))
+
+            entry = CachedAudio(
+                song_id=song.id,
+                filename=filename,
+                size=os.path.getsize(os.path.join(self.path, filename)),
+                hits=self._plays.pop(song.id, 0),
+            )
+            await self.music.save_cached_audio(entry)
+            self._entries[song.id] = entry
+            logging.info(f'Cached {song.name} ({entry.size} bytes)')
+
+            await self._evict()
+        except Exception as e:
+            logging.warning(f'Failed to cache {song.url} -> {e}')
+        finally:
+            self._downloading.discard(song.id)
+
+    def _victim(self) -> CachedAudio:
+        entries = self._entries.values()
+        if config.audio_cache.policy == 'lfu':
+            return min(entries, key=lambda e: (e.hits, e.last_played))
+        return min(entries, key=lambda e: e.last_played)
+
+    async def _evict(self):
+        """Вытеснение файлов до укладывания в бюджет"""
+
+        while self._entries and self.size > config.audio_cache.max_bytes:
+            await self.discard(self._victim().song_id)
+
+    async def discard(self, song_id: int):
+        """Удаление песни из кэша"""
+
+        entries = await self._load()
+        entry = entries.pop(song_id, None)
+        if entry is None:
+            return
+
+        try:
+            os.remove(os.path.join(self.path, entry.filename))
+        except FileNotFoundError:
+            pass
+        await self.music.remove_cached_audio(song_id)
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+import typing as t
+from collections import OrderedDict
+
+K = t.TypeVar('K')
+V = t.TypeVar('V')
+
+
+class TTLCache(t.Generic[K, V]):
+    """LRU-кэш с ограничением размера и сроком жизни каждой записи"""
+
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        """Получение значения, просроченные записи удаляются"""
+
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+
+            deadline, value = item
+            if deadline <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: K, value: V, ttl: float | None = None):
+        """Сохранение значения на ttl секунд (по умолчанию - ttl кэша)"""
+
+        ttl = self.ttl if ttl is None else ttl
+        deadline = time.monotonic() + ttl if ttl is not None else float('inf')
+
+        with self._lock:
+            self._data[key] = (deadline, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: K, default: V | None = None) -> V | None:
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SingleFlight(t.Generic[K, V]):
+    """Объединение одновременных одинаковых запросов в один
+
+    Пока запрос по ключу выполняется, остальные вызовы с тем же ключом
+    ждут его результат. Отмена одного из ожидающих не отменяет запрос.
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._calls: dict[K, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def run(self, key: K, factory: t.Callable[[], t.Awaitable[V]]) -> V:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.shared += 1
+
+        return await asyncio.shield(task)
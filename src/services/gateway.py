@@ -0,0 +1,66 @@
+import gc
+import os
+import resource
+import typing as t
+
+import discord
+
+from config import config
+
+# музыкальному боту нужны серверы, голосовые состояния и текст команд
+LEAN_INTENTS = ('guilds', 'voice_states', 'guild_messages', 'message_content')
+
+
+def intents() -> discord.Intents:
+    """Интенты шлюза по профилю из конфига"""
+
+    if config.gateway.intents is not None:
+        return discord.Intents(**{name: True for name in config.gateway.intents})
+    if config.gateway.profile == 'full':
+        return discord.Intents.all()
+    return discord.Intents(**{name: True for name in LEAN_INTENTS})
+
+
+def client_options() -> dict[str, t.Any]:
+    """Параметры клиента, влияющие на кэши discord.py"""
+
+    if config.gateway.profile == 'full' and config.gateway.intents is None:
+        return {'intents': intents()}
+
+    return {
+        'intents': intents(),
+        'member_cache_flags': discord.MemberCacheFlags(
+            **{flag: flag in config.gateway.member_cache
+               for flag in discord.MemberCacheFlags.VALID_FLAGS}
+        ),
+        'max_messages': config.gateway.max_messages or None,
+        'chunk_guilds_at_startup': config.gateway.chunk_guilds_at_startup,
+    }
+
+
+def rss_bytes() -> int:
+    """Текущий RSS процесса (на Linux), иначе пиковый"""
+
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def memory_report(bot: discord.Client) -> dict[str, t.Any]:
+    """Память процесса и размеры кэшей discord.py"""
+
+    rss = rss_bytes()
+    guilds = len(bot.guilds)
+    return {
+        'rss': rss,
+        'guilds': guilds,
+        'rss_per_guild': rss / guilds if guilds else None,
+        'members': sum(len(guild.members) for guild in bot.guilds),
+        'users': len(bot.users),
+        'messages': len(bot.cached_messages),
+        'voice_clients': len(bot.voice_clients),
+        'objects': len(gc.get_objects()),
+        'intents': [name for name, enabled in bot.intents if enabled],
+    }
@@ -0,0 +1,115 @@
+import asyncio
+import contextlib
+import logging
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from adapters import MusicAdapter
+from config import config
+from models.music import Playback
+
+
+class HistoryWriter:
+    """Буферизованная запись истории проигрываний.
+
+    События копятся в памяти и записываются одним многострочным INSERT,
+    когда их набирается history.flush_size или проходит
+    history.flush_interval секунд с первого незаписанного события.
+    После ошибки запись повторяется с растущей задержкой, а буфер
+    ограничен history.max_buffer событиями (старые отбрасываются).
+    """
+
+    def __init__(self, music: MusicAdapter):
+        self.music = music
+        self._buffer: list[Playback] = []
+        self._changed = asyncio.Event()
+        self._flusher: asyncio.Task | None = None
+        self._retry_delay = 0.0
+
+    def add(self, user: str, song_id: int, guild_id: int):
+        """Добавление проигрывания в буфер"""
+
+        self._buffer.append(Playback(song_id, user, guild_id, datetime.now()))
+        self._trim()
+
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+        self._changed.set()
+
+    async def _flush_loop(self):
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            deadline = asyncio.get_running_loop().time() + config.history.flush_interval
+            while len(self._buffer) < config.history.flush_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                self._changed.clear()
+
+            if await self.flush():
+                self._retry_delay = 0.0
+                continue
+
+            self._retry_delay = min(
+                max(self._retry_delay * 2, config.history.retry_delay),
+                config.history.max_retry_delay
+            )
+            await asyncio.sleep(self._retry_delay)
+            self._changed.set()
+
+    def _trim(self):
+        overflow = len(self._buffer) - config.history.max_buffer
+        if overflow > 0:
+            del self._buffer[:overflow]
+            logging.warning(f'History buffer is full, dropped {overflow} oldest playbacks')
+
+    async def _write(self, batch: list[Playback]):
+        """Запись пачки, проигрывания удаленных песен отбрасываются"""
+
+        try:
+            await self.music.add_to_history(batch)
+        except IntegrityError:
+            existing = await self.music.existing_song_ids(pb.song for pb in batch)
+            kept = [pb for pb in batch if pb.song in existing]
+            if len(kept) == len(batch):
+                raise
+            logging.warning(f'Dropped {len(batch) - len(kept)} playbacks of deleted songs')
+            if kept:
+                await self.music.add_to_history(kept)
+
+    async def flush(self) -> bool:
+        """Запись накопленных проигрываний в БД, False при ошибке"""
+
+        if not self._buffer:
+            return True
+
+        batch, self._buffer = self._buffer, []
+        try:
+            await self._write(batch)
+        except asyncio.CancelledError:
+            self._buffer[:0] = batch
+            self._trim()
+            raise
+        except Exception as e:
+            logging.error(f'Failed to write {len(batch)} playbacks -> {e}')
+            self._buffer[:0] = batch
+            self._trim()
+            return False
+        return True
+
+    async def close(self):
+        """Остановка фоновой записи с финальным сохранением"""
+
+        if self._flusher is not None:
+            self._flusher.cancel()
+            # прерванная запись возвращает проигрывания в буфер при отмене
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._flusher
+            self._flusher = None
+        await self.flush()
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import logging
+import os
+import re
+
+from adapters import MusicAdapter, YouTubeAdapter
+from config import config
+from models.music import Song
+from services.audio_cache import AudioCache
+
+LOUDNORM_JSON = re.compile(r'\{[^{}]*"input_i"[^{}]*\}', re.S)
+
+
+async def measure_loudness(location: str, local: bool = False) -> float | None:
+    """Интегральная громкость (EBU R128, LUFS) через фильтр loudnorm ffmpeg"""
+
+    args = ['ffmpeg', '-hide_banner', '-nostats', '-vn']
+    if not local:
+        args += ['-reconnect', '1', '-reconnect_streamed', '1']
+    args += [
+        '-i', location,
+        '-af', f'loudnorm=I={config.loudness.target}:print_format=json',
+        '-f', 'null', '-',
+    ]
+
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        _, stderr = await asyncio.wait_for(process.communicate(), config.loudness.timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise
+
+    match = LOUDNORM_JSON.search(stderr.decode(errors='replace'))
+    if process.returncode != 0 or match is None:
+        raise RuntimeError(f'ffmpeg exited with {process.returncode}')
+
+    loudness = float(json.loads(match.group())['input_i'])
+    # тишина дает -inf
+    return loudness if loudness > -70 else None
+
+
+def loudness_gain(loudness: float | None) -> float:
+    """Поправка в дБ до целевой громкости, усиление ограничено loudness.max_gain"""
+
+    if loudness is None:
+        return 0.0
+    return round(min(config.loudness.target - loudness, config.loudness.max_gain), 2)
+
+
+def gain_factor(gain_db: float | None) -> float:
+    """Множитель громкости по поправке в дБ"""
+
+    if not config.loudness.enabled or gain_db is None:
+        return 1.0
+    return 10 ** (gain_db / 20)
+
+
+class LoudnessAnalyzer:
+    """Измерение громкости песен с ограниченным параллелизмом
+
+    Громкость измеряется один раз и сохраняется в music.music.gain.
+    Локальный файл из кэша предпочтительнее потока: не нужна сеть.
+    """
+
+    def __init__(
+        self,
+        yt: YouTubeAdapter,
+        music: MusicAdapter,
+        audio_cache: AudioCache = None,
+        music_dir: str = '../music'
+    ):
+        self.yt = yt
+        self.music_dir = music_dir
+        self.music = music
+        self.audio_cache = audio_cache
+        self.gains: dict[int, float] = {}
+        self._semaphore = asyncio.Semaphore(config.loudness.concurrency)
+        self._pending: set[int] = set()
+        self._tasks: set[asyncio.Task] = set()
+
+    def gain(self, song: Song) -> float:
+        """Множитель громкости песни (1.0, пока громкость не измерена)"""
+
+        return gain_factor(song.gain if song.gain is not None else self.gains.get(song.id))
+
+    def schedule(self, song: Song):
+        """Фоновое измерение песни, если ее громкость еще неизвестна"""
+
+        if not (config.loudness.enabled and config.loudness.background):
+            return
+        if song.gain is not None or song.id in self.gains or song.id in self._pending:
+            return
+
+        self._pending.add(song.id)
+        task = asyncio.create_task(self.analyze(song))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def analyze(self, song: Song) -> float | None:
+        """Измерение и сохранение поправки, None при ошибке"""
+
+        try:
+            async with self._semaphore:
+                location, local = await self._locate(song)
+                gain = loudness_gain(await measure_loudness(location, local))
+            await self.music.set_song_gain(song.id, gain)
+            self.gains[song.id] = gain
+            return gain
+        except Exception as e:
+            logging.warning(f'Failed to measure loudness of {song.url} -> {e!r}')
+            return None
+        finally:
+            self._pending.discard(song.id)
+
+    async def _locate(self, song: Song) -> tuple[str, bool]:
+        # песни, добавленные из каталога (scripts/add_from_dir.py)
+        if not self.yt.validate_url(song.url, safe=True):
+            return os.path.join(self.music_dir, song.url), True
+
+        if self.audio_cache is not None:
+            path = await self.audio_cache.find(song.id)
+            if path is not None:
+                return path, True
+
+        info = await self.yt.extract_audio_info(song.url)
+        return info.audio_source, False
+
+    def close(self):
+        for task in list(self._tasks):
+            task.cancel()
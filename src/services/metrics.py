@@ -0,0 +1,146 @@
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import time
+import typing as t
+
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+from config import config
+
+COMMAND_LATENCY = Histogram(
+    'letov_command_seconds', 'Command handling time', ['command']
+)
+COMMAND_ERRORS = Counter(
+    'letov_command_errors_total', 'Failed commands', ['command']
+)
+DB_QUERY = Histogram(
+    'letov_db_query_seconds', 'MusicAdapter call time', ['method'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+)
+DB_POOL = Gauge(
+    'letov_db_pool_connections', 'DB pool connections', ['state']
+)
+DB_POOL_WAIT = Gauge(
+    'letov_db_pool_wait_max_seconds', 'Longest wait for a pooled connection'
+)
+EXTRACTION = Histogram(
+    'letov_youtube_seconds', 'yt-dlp and YouTube search time', ['operation'],
+    buckets=(.25, .5, 1, 2, 3, 5, 8, 13, 21, 34, 60)
+)
+EXTRACTION_FAILURES = Counter(
+    'letov_youtube_failures_total', 'Failed yt-dlp and YouTube search calls', ['operation']
+)
+FIRST_PACKET = Histogram(
+    'letov_play_to_first_packet_seconds',
+    'Time from the play command or the end of the previous track to the first audio frame',
+    buckets=(.1, .25, .5, 1, 2, 3, 5, 8, 13, 21)
+)
+VOICE_CLIENTS = Gauge(
+    'letov_voice_clients', 'Connected voice clients'
+)
+FFMPEG_PROCESSES = Gauge(
+    'letov_ffmpeg_processes', 'Running ffmpeg processes'
+)
+PLAYBACK_STAGE = Histogram(
+    'letov_playback_stage_seconds', 'Playback state machine stage time', ['stage'],
+    buckets=(.001, .01, .05, .1, .25, .5, 1, 2, 3, 5, 8, 13, 21, 34)
+)
+PLAYBACK_FAILURES = Counter(
+    'letov_playback_failures_total', 'Failed playback attempts', ['stage']
+)
+LOOP_LAG = Histogram(
+    'letov_event_loop_lag_seconds', 'Event loop scheduling delay',
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+)
+
+
+def timed_methods(histogram: Histogram):
+    """Декоратор класса: время выполнения всех публичных корутин"""
+
+    def decorator(cls):
+        for name, method in list(vars(cls).items()):
+            if name.startswith('_') or not inspect.iscoroutinefunction(method):
+                continue
+            setattr(cls, name, _timed(method, histogram.labels(name)))
+        return cls
+
+    return decorator
+
+
+def _timed(method: t.Callable, observer) -> t.Callable:
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            observer.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+async def _watch_loop_lag(interval: float = 0.5):
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - started - interval))
+
+
+def _track_pool():
+    from injectors import connections
+
+    for state in ('checked_out', 'checked_in', 'overflow'):
+        DB_POOL.labels(state).set_function(
+            lambda s=state: getattr(connections.pool_stats(), s)
+        )
+    DB_POOL_WAIT.set_function(lambda: connections.pool_stats().wait_max)
+
+
+async def _handle_metrics(_: web.Request) -> web.Response:
+    response = web.Response(body=generate_latest())
+    response.content_type = CONTENT_TYPE_LATEST.split(';')[0]
+    return response
+
+
+class MetricsServer:
+    """HTTP-эндпоинт /metrics в формате Prometheus"""
+
+    def __init__(self, voice_clients: t.Callable[[], t.Sized]):
+        self._runner: web.AppRunner | None = None
+        self._lag_task: asyncio.Task | None = None
+        VOICE_CLIENTS.set_function(lambda: len(voice_clients()))
+
+    async def start(self):
+        if not config.metrics.enabled:
+            return
+
+        _track_pool()
+        self._lag_task = asyncio.create_task(_watch_loop_lag())
+
+        app = web.Application()
+        app.router.add_get('/metrics', _handle_metrics)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        # процессы, запущенные launcher, слушают соседние порты
+        port = config.metrics.port + int(os.environ.get('LETOV_WORKER', 0))
+        try:
+            await web.TCPSite(self._runner, config.metrics.host, port).start()
+        except OSError as e:
+            # метрики необязательны и не должны мешать запуску бота
+            logging.error(f'Failed to serve metrics on {config.metrics.host}:{port} -> {e}')
+            await self._runner.cleanup()
+            self._runner = None
+            return
+        logging.info(f'Metrics on http://{config.metrics.host}:{port}/metrics')
+
+    async def stop(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+from typing import Callable
+
+from adapters.db import SONG_REMOVED
+from injectors import connections
+
+
+class SongRemovals:
+    """Получение id удаленных песен от всех процессов бота через LISTEN
+
+    Соединение держится вне пула и переподключается с нарастающей
+    паузой. Уведомления, пришедшие за время переподключения, теряются:
+    сохранение очереди все равно пропускает удаленные песни.
+    """
+
+    def __init__(
+        self,
+        on_removed: Callable[[int], None],
+        retry_delay: float = 1.0,
+        max_retry_delay: float = 60.0
+    ):
+        self.on_removed = on_removed
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen_loop())
+
+    def _notified(self, connection, pid: int, channel: str, payload: str):
+        try:
+            song_id = int(payload)
+        except ValueError:
+            logging.warning(f'Bad {channel} payload -> {payload!r}')
+            return
+        self.on_removed(song_id)
+
+    async def _listen_loop(self):
+        delay = self.retry_delay
+        while True:
+            connection = None
+            try:
+                connection = await connections.connect_raw()
+                await connection.add_listener(SONG_REMOVED, self._notified)
+                delay = self.retry_delay
+                while not connection.is_closed():
+                    await asyncio.sleep(self.max_retry_delay)
+                    # проверка, что соединение живо
+                    await connection.execute('SELECT 1;')
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f'Song removal listener failed -> {e!r}, retry in {delay} s')
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close(timeout=5)
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
@@ -0,0 +1,371 @@
+import asyncio
+import contextlib
+import dataclasses as dc
+import enum
+import logging
+import time
+import typing as t
+
+import discord
+from discord.ext import commands
+
+from adapters import YouTubeAdapter
+from config import config
+from models import exceptions
+from services import metrics
+from services.audio_cache import AudioCache
+from services.history import HistoryWriter
+from services.loudness import LoudnessAnalyzer
+from services.prefetch import Prefetcher
+from services.queue import QueueEntry, QueueService
+from services.sources import Track, create_source
+
+Notify = t.Callable[..., t.Awaitable[t.Any]]
+
+
+class PlayerState(str, enum.Enum):
+    IDLE = 'idle'
+    STARTING = 'starting'
+    PLAYING = 'playing'
+
+
+class EventKind(str, enum.Enum):
+    START = 'start'
+    FINISHED = 'finished'
+    STOP = 'stop'
+
+
+@dc.dataclass
+class PlayerEvent:
+    """Событие проигрывателя сервера"""
+
+    kind: EventKind = dc.field()
+    ctx: commands.Context | None = dc.field(default=None)
+    entry: QueueEntry | None = dc.field(default=None)
+    error: Exception | None = dc.field(default=None)
+    posted: float = dc.field(default_factory=time.perf_counter)
+
+
+class StageFailed(Exception):
+
+    def __init__(self, stage: str, error: Exception):
+        super().__init__(f'{stage}: {error}')
+        self.stage = stage
+        self.error = error
+
+
+class GuildPlayer:
+    """Конечный автомат проигрывания одного сервера
+
+    События обрабатываются по одному. Запуск песни (подключение и
+    разрешение ссылки) выполняется отдельной задачей, которую STOP или
+    новый START отменяют, не дожидаясь ее окончания. Поток аудиоплеера
+    discord.py только кладет событие FINISHED в очередь и сразу
+    возвращается, не дожидаясь БД и YouTube.
+    """
+
+    def __init__(self, guild_id: int, service: 'PlaybackService'):
+        self.guild_id = guild_id
+        self.service = service
+        self.state = PlayerState.IDLE
+        self.ctx: commands.Context | None = None
+        self.entry: QueueEntry | None = None
+        self.attempts = 0
+        # время команды play или окончания прошлой песни, от него считается FIRST_PACKET
+        self.requested = time.perf_counter()
+        self._loop = asyncio.get_running_loop()
+        self._events: asyncio.Queue[PlayerEvent] = asyncio.Queue()
+        self._starting: asyncio.Task | None = None
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def voice_client(self) -> discord.VoiceClient | None:
+        return self.ctx.voice_client if self.ctx is not None else None
+
+    def post(self, event: PlayerEvent):
+        self._events.put_nowait(event)
+
+    def post_threadsafe(self, event: PlayerEvent):
+        """Публикация события из чужого потока (callback after)"""
+
+        self._loop.call_soon_threadsafe(self._events.put_nowait, event)
+
+    def close(self):
+        self._task.cancel()
+        if self._starting is not None:
+            self._starting.cancel()
+
+    def _launch(self, coro: t.Coroutine):
+        """Запуск песни отдельной задачей"""
+
+        self.state = PlayerState.STARTING
+        self._starting = asyncio.create_task(coro)
+        self._starting.add_done_callback(self._launched)
+
+    def _launched(self, task: asyncio.Task):
+        if task.cancelled() or task.exception() is None:
+            return
+        error = task.exception()
+        logging.error(
+            f'Player of guild {self.guild_id} failed to start a song: {error}', exc_info=error
+        )
+        if task is self._starting:
+            self.state = PlayerState.IDLE
+            self.entry = None
+
+    async def _cancel_start(self):
+        """Отмена запуска песни, если он еще идет"""
+
+        task, self._starting = self._starting, None
+        if task is not None and not task.done():
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+    async def _run(self):
+        while True:
+            event = await self._events.get()
+            metrics.PLAYBACK_STAGE.labels('event_wait') \
+                .observe(time.perf_counter() - event.posted)
+            try:
+                await self._handle(event)
+            except Exception as e:
+                logging.exception(f'Player of guild {self.guild_id} failed on {event.kind.value}: {e}')
+                self.state = PlayerState.IDLE
+                self.entry = None
+
+    async def _handle(self, event: PlayerEvent):
+        match event.kind:
+            case EventKind.START:
+                if self.state is PlayerState.STARTING:
+                    # новый запуск заменяет текущий, разрешение ссылки
+                    # общее (SingleFlight) и не начинается заново
+                    await self._cancel_start()
+                    if self.state is PlayerState.PLAYING:
+                        return
+                if self.state is not PlayerState.PLAYING:
+                    self.ctx = event.ctx
+                    self.attempts = 0
+                    self.requested = event.posted
+                    self._launch(self._start_next())
+
+            case EventKind.FINISHED:
+                if event.entry is not self.entry:
+                    return
+                await self._finished(event)
+
+            case EventKind.STOP:
+                await self._cancel_start()
+                await self._stop()
+
+    async def _finished(self, event: PlayerEvent):
+        queue = await self.service.queues.get(self.guild_id)
+
+        if event.error is not None:
+            logging.warning(f'Playback of {event.entry.song.url} failed -> {event.error}')
+            metrics.PLAYBACK_FAILURES.labels('playback').inc()
+            # ссылка на поток могла протухнуть, при повторе она разрешится заново
+            await self.service.yt.invalidate_stream(event.entry.song.url)
+            if self.attempts < config.playback.retries:
+                self._launch(self._retry())
+                return
+
+        queue.remove(event.entry.key)
+        self.entry = None
+        self.attempts = 0
+        self.requested = event.posted
+
+        if self.voice_client is None:
+            self.state = PlayerState.IDLE
+            return
+        self._launch(self._advance(event.posted))
+
+    async def _retry(self):
+        await asyncio.sleep(config.playback.retry_delay)
+        await self._start_next(retry=True)
+
+    async def _advance(self, finished: float):
+        await self._start_next()
+        metrics.PLAYBACK_STAGE.labels('transition').observe(time.perf_counter() - finished)
+
+    async def _stop(self):
+        vc = self.voice_client
+        if self.entry is not None:
+            queue = await self.service.queues.get(self.guild_id)
+            queue.remove(self.entry.key)
+        self.entry = None
+        self.state = PlayerState.IDLE
+        self.service.prefetch.invalidate(self.guild_id)
+        if vc is not None:
+            await vc.disconnect(force=False)
+
+    async def _stage(self, stage: str, coro: t.Awaitable, timeout: float) -> t.Any:
+        """Этап перехода с ограничением времени и замером"""
+
+        started = time.perf_counter()
+        try:
+            return await asyncio.wait_for(coro, timeout)
+        except Exception as e:
+            metrics.PLAYBACK_FAILURES.labels(stage).inc()
+            raise StageFailed(stage, e) from e
+        finally:
+            metrics.PLAYBACK_STAGE.labels(stage).observe(time.perf_counter() - started)
+
+    async def _start_next(self, retry: bool = False):
+        """Запуск первой песни очереди, при пустой очереди - отключение
+
+        Песни, которые не удалось разрешить, пропускаются, временные
+        ошибки повторяются до playback.retries раз.
+        """
+
+        service = self.service
+        queue = await service.queues.get(self.guild_id)
+
+        while True:
+            entry = queue.first()
+            if entry is None:
+                self.state = PlayerState.IDLE
+                self.entry = None
+                service.prefetch.invalidate(self.guild_id)
+                if self.voice_client is not None:
+                    await self.voice_client.disconnect(force=False)
+                return
+
+            self.state = PlayerState.STARTING
+            self.entry = entry
+            self.attempts = self.attempts + 1 if retry else 1
+
+            if not await self._connect():
+                self.state = PlayerState.IDLE
+                self.entry = None
+                return
+
+            try:
+                track = await self._stage(
+                    'resolve', self._resolve(entry), config.playback.resolve_timeout
+                )
+                break
+            except StageFailed as e:
+                retry = self._transient(e.error) and self.attempts < config.playback.retries
+                if retry:
+                    await asyncio.sleep(config.playback.retry_delay * self.attempts)
+                    continue
+
+                logging.warning(f'Failed to resolve {entry.song.url} -> {e.error!r}')
+                await service.notify(
+                    self.ctx, f'Failed to play **{entry.song.name}**, skipping',
+                    color=discord.Colour.red())
+                queue.remove(entry.key)
+
+        started = time.perf_counter()
+        self.voice_client.play(
+            create_source(track, service.gain()),
+            after=lambda error: self.post_threadsafe(
+                PlayerEvent(EventKind.FINISHED, entry=entry, error=error)
+            )
+        )
+        metrics.PLAYBACK_STAGE.labels('start').observe(time.perf_counter() - started)
+        self.state = PlayerState.PLAYING
+
+        # до ожидания notify, чтобы отмена запуска не потеряла запись в истории
+        service.prefetch.schedule(self.guild_id)
+        if self.attempts == 1:
+            service.history.add(self.ctx.author.nick, entry.song.id, self.guild_id)
+            service.loudness.schedule(entry.song)
+            await service.notify(self.ctx, f'Playing **{entry.song.name}**')
+
+    async def _connect(self) -> bool:
+        """Подключение к голосовому каналу автора команды"""
+
+        if self.voice_client is not None:
+            return True
+
+        channel = getattr(self.ctx.author.voice, 'channel', None)
+        if channel is None:
+            await self.service.notify(
+                self.ctx, 'Connect to a voice channel before playing.',
+                color=discord.Colour.red())
+            return False
+
+        try:
+            await self._stage('connect', channel.connect(), config.playback.connect_timeout)
+        except asyncio.CancelledError:
+            await self._drop_voice_client()
+            raise
+        except StageFailed as e:
+            await self._drop_voice_client()
+            logging.warning(f'Failed to connect in guild {self.guild_id} -> {e.error!r}')
+            await self.service.notify(
+                self.ctx, 'Failed to connect to the voice channel.',
+                color=discord.Colour.red())
+            return False
+        return True
+
+    async def _drop_voice_client(self):
+        # прерванное подключение оставляет зарегистрированный голосовой клиент
+        if self.voice_client is not None:
+            await self.voice_client.disconnect(force=True)
+
+    async def _resolve(self, entry: QueueEntry) -> Track:
+        started = self.requested
+        gain = self.service.loudness.gain(entry.song)
+        path = await self.service.audio_cache.lookup(entry.song)
+        if path is not None:
+            return Track(path, local=True, started=started, gain=gain)
+
+        info = await self.service.yt.extract_audio_info(entry.song.url)
+        return Track(info.audio_source, codec=info.codec, started=started, gain=gain)
+
+    @staticmethod
+    def _transient(error: Exception) -> bool:
+        return isinstance(error, (
+            asyncio.TimeoutError, exceptions.ResolverBusy, exceptions.ResolveTimeout
+        ))
+
+
+class PlaybackService:
+    """Проигрыватели серверов и команды управления ими"""
+
+    def __init__(
+        self,
+        queues: QueueService,
+        yt: YouTubeAdapter,
+        audio_cache: AudioCache,
+        history: HistoryWriter,
+        prefetch: Prefetcher,
+        loudness: LoudnessAnalyzer,
+        gain: t.Callable[[], float],
+        notify: Notify,
+    ):
+        self.queues = queues
+        self.yt = yt
+        self.audio_cache = audio_cache
+        self.history = history
+        self.prefetch = prefetch
+        self.loudness = loudness
+        self.gain = gain
+        self.notify = notify
+        self._players: dict[int, GuildPlayer] = {}
+
+    def player(self, guild_id: int) -> GuildPlayer:
+        player = self._players.get(guild_id)
+        if player is None:
+            player = self._players[guild_id] = GuildPlayer(guild_id, self)
+        return player
+
+    def state(self, guild_id: int) -> PlayerState:
+        player = self._players.get(guild_id)
+        return player.state if player is not None else PlayerState.IDLE
+
+    def start(self, ctx: commands.Context):
+        """Запуск проигрывания очереди, если сервер ничего не играет"""
+
+        self.player(ctx.guild.id).post(PlayerEvent(EventKind.START, ctx=ctx))
+
+    def stop(self, ctx: commands.Context):
+        self.player(ctx.guild.id).post(PlayerEvent(EventKind.STOP))
+
+    def close(self):
+        for player in self._players.values():
+            player.close()
+        self._players.clear()
@@ -0,0 +1,52 @@
+import asyncio
+import logging
+
+from adapters import YouTubeAdapter
+from config import config
+from services.queue import QueueService
+
+
+class Prefetcher:
+    """Фоновое разрешение следующих песен очереди.
+
+    Пока играет текущая песня, ссылки на потоки следующих песен
+    извлекаются заранее и попадают в кэш YouTubeAdapter, поэтому
+    переход между песнями не ждет yt-dlp.
+    """
+
+    def __init__(self, yt: YouTubeAdapter, queues: QueueService):
+        self.yt = yt
+        self.queues = queues
+        self.depth = config.youtube.prefetch_depth
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    def schedule(self, guild_id: int):
+        """Перепланирование предзагрузки после изменения очереди"""
+
+        self.invalidate(guild_id)
+        if self.depth > 0:
+            self._tasks[guild_id] = asyncio.create_task(self._prefetch(guild_id))
+
+    def invalidate(self, guild_id: int):
+        """Отмена предзагрузки для сервера"""
+
+        task = self._tasks.pop(guild_id, None)
+        if task is not None:
+            task.cancel()
+
+    def close(self):
+        for guild_id in list(self._tasks):
+            self.invalidate(guild_id)
+
+    async def _prefetch(self, guild_id: int):
+        # первая позиция очереди - песня, которая играет сейчас
+        queue = await self.queues.get(guild_id)
+        for entry in queue.head(self.depth + 1)[1:]:
+            try:
+                await self.yt.extract_audio_info(entry.song.url)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f'Prefetch of {entry.song.url} failed -> {e}')
+
+        self._tasks.pop(guild_id, None)
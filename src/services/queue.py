@@ -0,0 +1,231 @@
+import asyncio
+import contextlib
+import dataclasses as dc
+import itertools
+import logging
+import typing as t
+from collections import OrderedDict
+
+from adapters import MusicAdapter
+from config import config
+from models.music import Song
+
+_keys = itertools.count(1)
+
+
+@dc.dataclass
+class QueueEntry:
+    """Позиция очереди воспроизведения в памяти"""
+
+    song: Song = dc.field()
+    key: int = dc.field(default_factory=lambda: next(_keys))
+
+
+class GuildQueue:
+    """Очередь воспроизведения сервера.
+
+    Позиции хранятся в OrderedDict по ключу, поэтому добавление, удаление,
+    перемещение в начало/конец и снятие первой позиции работают за O(1).
+    Суммарная длительность поддерживается при каждом изменении.
+    Каждое изменение отмечает очередь для отложенной записи в БД.
+    """
+
+    def __init__(
+        self,
+        guild_id: int,
+        songs: t.Iterable[Song] = (),
+        on_change: t.Callable[[int], None] = None
+    ):
+        self.guild_id = guild_id
+        self.duration = 0
+        self._entries: OrderedDict[int, QueueEntry] = OrderedDict()
+        self._on_change = on_change
+
+        for song in songs:
+            self._insert(song)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> t.Iterator[QueueEntry]:
+        return iter(self._entries.values())
+
+    def _changed(self):
+        if self._on_change is not None:
+            self._on_change(self.guild_id)
+
+    def _insert(self, song: Song) -> QueueEntry:
+        entry = QueueEntry(song)
+        self._entries[entry.key] = entry
+        self.duration += song.duration or 0
+        return entry
+
+    def _delete(self, key: int) -> QueueEntry | None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.duration -= entry.song.duration or 0
+        return entry
+
+    def first(self) -> QueueEntry | None:
+        """Первая позиция очереди"""
+
+        return next(iter(self._entries.values()), None)
+
+    def head(self, count: int) -> list[QueueEntry]:
+        """Первые count позиций очереди"""
+
+        return self.slice(0, count)
+
+    def slice(self, start: int, count: int) -> list[QueueEntry]:
+        """count позиций, начиная с порядкового номера start (с нуля)"""
+
+        return list(itertools.islice(self._entries.values(), start, start + count))
+
+    def at(self, index: int) -> QueueEntry:
+        """Позиция по порядковому номеру (с нуля)"""
+
+        if not 0 <= index < len(self._entries):
+            raise IndexError(index)
+        return next(itertools.islice(self._entries.values(), index, None))
+
+    def append(self, song: Song) -> QueueEntry:
+        entry = self._insert(song)
+        self._changed()
+        return entry
+
+    def pop(self) -> QueueEntry | None:
+        """Снятие первой позиции очереди"""
+
+        entry = self.first()
+        if entry is not None:
+            self.remove(entry.key)
+        return entry
+
+    def remove(self, key: int) -> QueueEntry | None:
+        entry = self._delete(key)
+        if entry is not None:
+            self._changed()
+        return entry
+
+    def remove_at(self, index: int) -> QueueEntry:
+        """Удаление позиции по порядковому номеру (с нуля)"""
+
+        entry = self.at(index)
+        self.remove(entry.key)
+        return entry
+
+    def move(self, key: int, last: bool = True):
+        """Перемещение позиции в конец (или начало) очереди"""
+
+        self._entries.move_to_end(key, last)
+        self._changed()
+
+    def discard_song(self, song_id: int):
+        """Удаление всех позиций с песней"""
+
+        keys = [k for k, e in self._entries.items() if e.song.id == song_id]
+        for key in keys:
+            self._delete(key)
+        if keys:
+            self._changed()
+
+    def clear(self):
+        if self._entries:
+            self._entries.clear()
+            self.duration = 0
+            self._changed()
+
+    def song_ids(self) -> list[int]:
+        return [entry.song.id for entry in self._entries.values()]
+
+
+class QueueService:
+    """Очереди всех серверов в памяти с отложенной записью в БД.
+
+    Очередь сервера восстанавливается из music.queue при первом обращении,
+    дальше источником истины служит память. Измененные очереди
+    записываются в БД раз в queue.flush_interval секунд, каждая
+    своей транзакцией, чтобы ошибка одной не блокировала остальные.
+    """
+
+    def __init__(self, music: MusicAdapter):
+        self.music = music
+        self._queues: dict[int, GuildQueue] = {}
+        self._dirty: set[int] = set()
+        self._changed = asyncio.Event()
+        self._load_lock = asyncio.Lock()
+        self._flusher: asyncio.Task | None = None
+
+    async def get(self, guild_id: int) -> GuildQueue:
+        """Очередь сервера"""
+
+        queue = self._queues.get(guild_id)
+        if queue is not None:
+            return queue
+
+        async with self._load_lock:
+            if guild_id not in self._queues:
+                songs = await self.music.get_queue(guild_id)
+                self._queues[guild_id] = GuildQueue(
+                    guild_id, songs, self._mark_dirty
+                )
+        return self._queues[guild_id]
+
+    def discard_song(self, song_id: int):
+        """Удаление песни из всех загруженных очередей"""
+
+        for queue in self._queues.values():
+            queue.discard_song(song_id)
+
+    def _mark_dirty(self, guild_id: int):
+        self._dirty.add(guild_id)
+        self._changed.set()
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await self._changed.wait()
+            await asyncio.sleep(config.queue.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Запись измененных очередей в БД"""
+
+        self._changed.clear()
+        if not self._dirty:
+            return
+
+        batch = {
+            guild_id: self._queues[guild_id].song_ids()
+            for guild_id in self._dirty
+        }
+        self._dirty.clear()
+
+        missing: set[int] = set()
+        for guild_id, song_ids in batch.items():
+            try:
+                missing |= await self.music.save_queue(guild_id, song_ids)
+            except asyncio.CancelledError:
+                self._dirty.update(batch)
+                raise
+            except Exception as e:
+                logging.error(f'Failed to persist queue of guild {guild_id} -> {e}')
+                self._dirty.add(guild_id)
+                self._changed.set()
+
+        # песни удалены из библиотеки, возможно другим процессом бота
+        for song_id in missing:
+            logging.warning(f'Song {song_id} no longer exists, removed from queues')
+            self.discard_song(song_id)
+
+    async def close(self):
+        """Остановка фоновой записи с финальным сохранением"""
+
+        if self._flusher is not None:
+            self._flusher.cancel()
+            # прерванная запись снова помечает очереди измененными
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._flusher
+            self._flusher = None
+        await self.flush()
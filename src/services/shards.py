@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+
+from discord.ext import commands
+from prometheus_client import Gauge
+
+from adapters.db import MusicAdapter
+from adapters.shards import ShardAdapter
+from config import config
+from models.shards import ShardHealth
+
+SHARD_LATENCY = Gauge(
+    'letov_shard_latency_seconds', 'Gateway heartbeat latency', ['shard']
+)
+SHARD_GUILDS = Gauge(
+    'letov_shard_guilds', 'Guilds served by shard', ['shard']
+)
+
+
+def shard_ids() -> list[int] | None:
+    """Шарды этого процесса, заданные запускающим процессом"""
+
+    ids = os.environ.get('LETOV_SHARD_IDS')
+    return [int(shard) for shard in ids.split(',')] if ids else None
+
+
+def shard_count() -> int | None:
+    count = os.environ.get('LETOV_SHARD_COUNT')
+    return int(count) if count else config.sharding.shard_count
+
+
+def create_bot(**options) -> commands.Bot:
+    """Бот с автошардингом, если он включен или задан запускающим процессом"""
+
+    ids = shard_ids()
+    if not (config.sharding.enabled or ids):
+        return commands.Bot(**options)
+
+    return commands.AutoShardedBot(
+        shard_count=shard_count(), shard_ids=ids, **options
+    )
+
+
+class ShardMonitor:
+    """Периодическая запись состояния шардов процесса в БД
+
+    Состояние всех процессов видно в misc.shards и в метриках.
+    Процесс с шардом 0 заодно чистит просроченные ссылки на потоки.
+    """
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.shards = ShardAdapter()
+        self.music = MusicAdapter()
+        self._status: dict[int, str] = {}
+        self._task: asyncio.Task | None = None
+
+    def _shard_ids(self) -> list[int]:
+        if isinstance(self.bot, commands.AutoShardedBot):
+            return sorted(self.bot.shards)
+        return [self.bot.shard_id or 0]
+
+    def _latency(self, shard_id: int) -> float | None:
+        if isinstance(self.bot, commands.AutoShardedBot):
+            shard = self.bot.get_shard(shard_id)
+            latency = shard.latency if shard is not None else None
+        else:
+            latency = self.bot.latency
+        # до первого heartbeat discord.py отдает inf
+        return latency if latency is not None and latency != float('inf') else None
+
+    def snapshot(self) -> list[ShardHealth]:
+        """Текущее состояние шардов процесса"""
+
+        guilds: dict[int, int] = {}
+        for guild in self.bot.guilds:
+            guilds[guild.shard_id] = guilds.get(guild.shard_id, 0) + 1
+        voice: dict[int, int] = {}
+        for vc in self.bot.voice_clients:
+            shard_id = vc.guild.shard_id
+            voice[shard_id] = voice.get(shard_id, 0) + 1
+
+        host, pid = socket.gethostname(), os.getpid()
+        count = self.bot.shard_count or 1
+        return [
+            ShardHealth(
+                shard_id=shard_id,
+                shard_count=count,
+                status=self._status.get(shard_id, 'connecting'),
+                host=host[:64],
+                pid=pid,
+                guilds=guilds.get(shard_id, 0),
+                voice_clients=voice.get(shard_id, 0),
+                latency=self._latency(shard_id),
+                updated_at=datetime.now(),
+            )
+            for shard_id in self._shard_ids()
+        ]
+
+    @staticmethod
+    def is_stale(shard: ShardHealth) -> bool:
+        """Процесс шарда давно не сообщал о себе"""
+
+        deadline = datetime.now() - timedelta(seconds=3 * config.sharding.health_interval)
+        return shard.updated_at < deadline
+
+    def set_status(self, shard_id: int | None, status: str):
+        self._status[shard_id or 0] = status
+
+    async def report(self):
+        shards = self.snapshot()
+        for shard in shards:
+            SHARD_GUILDS.labels(shard.shard_id).set(shard.guilds)
+            if shard.latency is not None:
+                SHARD_LATENCY.labels(shard.shard_id).set(shard.latency)
+        await self.shards.save_health(shards)
+
+        if 0 in self._shard_ids() and config.sharding.shared_streams:
+            await self.music.purge_streams()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.report()
+            except Exception as e:
+                logging.warning(f'Failed to report shard health -> {e}')
+            await asyncio.sleep(config.sharding.health_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        for shard_id in self._shard_ids():
+            self._status[shard_id] = 'stopped'
+        try:
+            await self.shards.save_health(self.snapshot())
+        except Exception as e:
+            logging.warning(f'Failed to report shard shutdown -> {e}')
@@ -0,0 +1,192 @@
+import dataclasses as dc
+import threading
+import time
+
+import discord
+
+from config import config
+from services import metrics
+
+FRAME_DURATION = 0.02
+# допуск единичной громкости, при котором Opus не перекодируется
+PASSTHROUGH_TOLERANCE = 1e-3
+
+STREAM_BEFORE_OPTIONS = '-analyzeduration 0 ' \
+                        '-re ' \
+                        '-reconnect 1 ' \
+                        '-reconnect_streamed 1 ' \
+                        '-reconnect_delay_max 5 '
+FILE_BEFORE_OPTIONS = '-analyzeduration 0 '
+OPTIONS = '-vn ' \
+          '-bufsize 64k '
+
+
+@dc.dataclass
+class Track:
+    """Источник звука для ffmpeg"""
+
+    location: str = dc.field()
+    local: bool = dc.field(default=False)
+    codec: str | None = dc.field(default=None)
+    started: float = dc.field(default_factory=time.perf_counter)
+    # множитель выравнивания громкости трека, складывается с громкостью сервера
+    gain: float = dc.field(default=1.0)
+
+    @property
+    def before_options(self) -> str:
+        return FILE_BEFORE_OPTIONS if self.local else STREAM_BEFORE_OPTIONS
+
+
+class TrackedSource:
+    """Учет проигранных кадров и запущенных процессов ffmpeg"""
+
+    track: Track
+    start: float = 0.0
+    frames: int = 0
+    _running: bool = False
+
+    def _started(self):
+        self._running = True
+        metrics.FFMPEG_PROCESSES.inc()
+
+    def _count(self, data: bytes) -> bytes:
+        if data:
+            if self.frames == 0 and self.start == 0:
+                metrics.FIRST_PACKET.observe(time.perf_counter() - self.track.started)
+            self.frames += 1
+        return data
+
+    def _stopped(self):
+        if self._running:
+            self._running = False
+            metrics.FFMPEG_PROCESSES.dec()
+
+    @property
+    def position(self) -> float:
+        """Проигранное время в секундах"""
+
+        return self.start + self.frames * FRAME_DURATION
+
+
+class GainOpusAudio(TrackedSource, discord.AudioSource):
+    """Opus-источник, громкость которого применяет сам ffmpeg.
+
+    Звук не проходит через Python в виде PCM: ffmpeg сам кодирует Opus,
+    а при единичной громкости и Opus на входе просто перепаковывает пакеты.
+    Для смены громкости запускается новый ffmpeg с текущей позиции, он
+    подменяет старый в потоке проигрывателя при следующем чтении.
+    gain - громкость сервера, к ней добавляется выравнивание track.gain.
+    """
+
+    def __init__(self, track: Track, gain: float, start: float = 0.0):
+        self.track = track
+        self.gain = gain
+        self.start = start
+        self.frames = 0
+        self._lock = threading.Lock()
+        self._next: discord.FFmpegOpusAudio | None = None
+        self._closed = False
+        self._process = self._open(gain, start)
+        self._started()
+
+    def _open(self, gain: float, start: float) -> discord.FFmpegOpusAudio:
+        volume = gain * self.track.gain
+        # отличие меньше 0.01 дБ неслышно, а перекодирование не бесплатно
+        passthrough = abs(volume - 1.0) < PASSTHROUGH_TOLERANCE \
+            and self.track.codec == 'opus'
+        before_options = self.track.before_options
+        if start > 0:
+            before_options = f'-ss {start:.2f} ' + before_options
+        options = OPTIONS
+        if not passthrough:
+            options += f'-filter:a volume={volume:.5f} '
+
+        return discord.FFmpegOpusAudio(
+            self.track.location,
+            bitrate=config.playback.bitrate,
+            codec='opus' if passthrough else None,
+            before_options=before_options,
+            options=options
+        )
+
+    def is_opus(self) -> bool:
+        return True
+
+    def read(self) -> bytes:
+        with self._lock:
+            previous = None
+            if self._next is not None:
+                previous, self._process, self._next = self._process, self._next, None
+        # старый ffmpeg останавливается в потоке проигрывателя, когда он уже не читается
+        if previous is not None:
+            previous.cleanup()
+        return self._count(self._process.read())
+
+    def set_gain(self, gain: float):
+        """Смена громкости без прерывания проигрывания"""
+
+        if gain == self.gain:
+            return
+        process = self._open(gain, self.position)
+        with self._lock:
+            if self._closed:
+                # трек закончился, пока запускался ffmpeg
+                replaced = process
+            else:
+                replaced, self._next = self._next, process
+                self.gain = gain
+        if replaced is not None:
+            replaced.cleanup()
+
+    def cleanup(self):
+        with self._lock:
+            processes = [self._process, self._next]
+            self._next = None
+            self._closed = True
+        for process in processes:
+            if process is not None:
+                process.cleanup()
+        self._stopped()
+
+
+class GainPCMAudio(TrackedSource, discord.PCMVolumeTransformer):
+    """PCM-источник с громкостью, применяемой к каждому кадру в Python"""
+
+    def __init__(self, track: Track, gain: float):
+        self.track = track
+        self.frames = 0
+
+        super().__init__(
+            discord.FFmpegPCMAudio(
+                track.location,
+                before_options=track.before_options,
+                options=OPTIONS
+            ), gain * track.gain)
+        self._started()
+
+    def read(self) -> bytes:
+        return self._count(super().read())
+
+    def cleanup(self):
+        super().cleanup()
+        self._stopped()
+
+
+def create_source(track: Track, gain: float) -> discord.AudioSource:
+    """Создание источника в соответствии с playback.mode"""
+
+    if config.playback.mode == 'pcm':
+        return GainPCMAudio(track, gain)
+    return GainOpusAudio(track, gain)
+
+
+def set_gain(voice_client: discord.VoiceClient, gain: float):
+    """Изменение громкости проигрываемого источника"""
+
+    source = voice_client.source
+    if isinstance(source, GainPCMAudio):
+        source.volume = gain * source.track.gain
+    elif isinstance(source, discord.PCMVolumeTransformer):
+        source.volume = gain
+    elif isinstance(source, GainOpusAudio):
+        source.set_gain(gain)
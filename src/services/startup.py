@@ -0,0 +1,72 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Gauge
+
+STARTUP_PHASE = Gauge(
+    'letov_startup_phase_seconds', 'Duration of startup phases', ['phase']
+)
+
+
+def process_age() -> float | None:
+    """Сколько секунд назад запущен процесс (только Linux)"""
+
+    try:
+        with open('/proc/self/stat') as file:
+            # поле comm в скобках может содержать пробелы
+            fields = file.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as file:
+            uptime = float(file.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    return uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+
+
+class StartupPhases:
+    """Замер времени этапов запуска до готовности бота"""
+
+    def __init__(self):
+        self.phases: dict[str, float] = {}
+        self._started: dict[str, float] = {}
+        self._origin = time.perf_counter() - (process_age() or 0)
+        self.ready = False
+
+    def record(self, phase: str, seconds: float):
+        self.phases[phase] = seconds
+        STARTUP_PHASE.labels(phase).set(seconds)
+        logging.info(f'Startup: {phase} took {seconds:.2f} s')
+
+    def begin(self, phase: str):
+        self._started[phase] = time.perf_counter()
+
+    def end(self, phase: str):
+        started = self._started.pop(phase, None)
+        if started is not None:
+            self.record(phase, time.perf_counter() - started)
+
+    @contextmanager
+    def measure(self, phase: str):
+        self.begin(phase)
+        try:
+            yield
+        finally:
+            self.end(phase)
+
+    def since_start(self) -> float:
+        return time.perf_counter() - self._origin
+
+    def mark_ready(self):
+        """Отметка о готовности, учитывается только первая"""
+
+        if self.ready:
+            return
+        self.ready = True
+        total = self.since_start()
+        self.record('total', total)
+        details = ', '.join(f'{name} {seconds:.2f}' for name, seconds in self.phases.items())
+        logging.info(f'Ready in {total:.2f} s ({details})')
+
+
+phases = StartupPhases()
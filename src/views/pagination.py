@@ -0,0 +1,97 @@
+import typing as t
+
+import discord
+from discord.ext import commands
+
+
+class KeysetPaginator(discord.ui.View):
+    """Листание страниц списка в одном сообщении.
+
+    Страницы запрашиваются по одной через fetch(after, before, limit),
+    где after/before - ключ последнего/первого элемента текущей страницы.
+    Загружается на один элемент больше страницы, чтобы знать, есть ли
+    следующая, поэтому память и число запросов не зависят от длины списка.
+    """
+
+    def __init__(
+        self,
+        fetch: t.Callable[[t.Any, t.Any, int], t.Awaitable[list]],
+        key: t.Callable[[t.Any], t.Any],
+        render: t.Callable[[list, int], discord.Embed],
+        *,
+        page_size: int = 20,
+        timeout: float = 120
+    ):
+        super().__init__(timeout=timeout)
+        self.fetch = fetch
+        self.key = key
+        self.render = render
+        self.page_size = page_size
+        self.page = 0
+        self.items: list = []
+        self.message: discord.Message | None = None
+        self.author_id: int | None = None
+
+    async def _load(self, after=None, before=None) -> bool:
+        items = await self.fetch(after, before, self.page_size + 1)
+        if not items:
+            return False
+
+        more = len(items) > self.page_size
+        if before is not None:
+            self.items = items[-self.page_size:]
+            self.prev_page.disabled = not more
+            self.next_page.disabled = False
+        else:
+            self.items = items[:self.page_size]
+            self.prev_page.disabled = after is None
+            self.next_page.disabled = not more
+        return True
+
+    async def start(self, ctx: commands.Context) -> bool:
+        """Отправка первой страницы, False - если список пуст"""
+
+        if not await self._load():
+            return False
+        self.author_id = ctx.author.id
+
+        if self.prev_page.disabled and self.next_page.disabled:
+            self.stop()
+            await ctx.send(embed=self.render(self.items, self.page))
+        else:
+            self.message = await ctx.send(
+                embed=self.render(self.items, self.page), view=self
+            )
+        return True
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        """Листать может только автор команды"""
+
+        if interaction.user.id == self.author_id:
+            return True
+        await interaction.response.send_message(
+            'Only the command author can turn pages', ephemeral=True
+        )
+        return False
+
+    @discord.ui.button(label='◀', style=discord.ButtonStyle.secondary)
+    async def prev_page(self, interaction: discord.Interaction, _: discord.ui.Button):
+        if await self._load(before=self.key(self.items[0])):
+            self.page -= 1
+        await interaction.response.edit_message(
+            embed=self.render(self.items, self.page), view=self
+        )
+
+    @discord.ui.button(label='▶', style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, _: discord.ui.Button):
+        if await self._load(after=self.key(self.items[-1])):
+            self.page += 1
+        await interaction.response.edit_message(
+            embed=self.render(self.items, self.page), view=self
+        )
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message is not None:
+            await self.message.edit(view=self)